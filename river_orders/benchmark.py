@@ -0,0 +1,50 @@
+#! -*- coding: utf8 -*-
+"""
+Compares the throughput of the row sources `construct` can be fed with:
+
+    $ python3 -m river_orders.benchmark data/v15.csv
+"""
+import time
+import argparse
+
+import pandas as pd
+
+from river_orders.build import WaterObject
+from river_orders.build_river_network import prepare, stream, _classified
+
+
+def iterrows(df):
+    """
+    Row source `construct` used to be built on
+    """
+    for index, r in df.iterrows():
+        river = WaterObject(_name=r.river_full_name, volume=index[0], index=index[1],
+                            **{f: r["river_" + f] for f in _classified}, **r)
+        dest = WaterObject(_name=r.river_dest,
+                           **{f: r["dest_" + f] for f in _classified})
+        yield index, river, dest
+
+
+def measure(source, df):
+    start = time.perf_counter()
+    rows = sum(1 for _ in source(df))
+    return rows, rows / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("datafile", help="CSV file with initial data", type=str)
+    parser.add_argument("-r", "--repeat", help="Number of runs", type=int, default=3)
+    options = parser.parse_args()
+
+    df = prepare(pd.read_csv(options.datafile, sep=";"))
+
+    results = {}
+    for source in (iterrows, stream):
+        rows, speed = max(measure(source, df) for _ in range(options.repeat))
+        results[source.__name__] = speed
+        print("{:>10}: {} rows, {:.0f} rows/s".format(source.__name__, rows, speed))
+    print("Speedup: {:.1f}x".format(results["stream"] / results["iterrows"]))
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,25 @@
 #! -*- coding: utf8 -*-
 import re
+import json
 import pprint
 import logging
+import warnings
+from bisect import bisect
 from itertools import chain
-from collections import OrderedDict
+from collections import OrderedDict, Counter
+from concurrent.futures import ProcessPoolExecutor
 from distutils.util import strtobool
 
 from numpy import isnan
 import pandas
 
 from .naming import NameSuggestion
+from .fuzzy import TrigramIndex
 from .graph import DirectedGraph
+from .results import Results
+from .network import export, ReadOnlyNetwork
+from .output import writers
+from .stats import Stats, recording, active
 
 _lost = (
     '^теряется(\s+в\s+(болот(е|ах)|пойме))?(\s+р.\s+[А-Яа-я-]+)?$',
@@ -43,26 +52,53 @@ class WaterObject(object):
     Represents any strem hydrological object. Attempts to handle in a simple way
     complicated name situation (noname river or river that flows into nowhere)
     """
+    __slots__ = ('names', 'multiname', 'length', 'dest_from_end',
+                 'ten_km_trib_amount', 'volume', 'index', 'main_name',
+                 'indexed_name', 'volume_indexed_name', 'nameless', 'lost',
+                 'is_lake', 'is_sea', 'name', '_hash')
+
     _split_pattern = re.compile(r'[,)(]{1}')
-    _lost_patterns = [re.compile(p) for p in _lost]
+    # Every category is checked with the only alternation
+    _lost_pattern = re.compile('|'.join(_lost))
     _nameless_pattern = re.compile(r'без названия')
-    _lake_patterns = [re.compile(p) for p in _lake_signs]
-    _sea_patterns = [re.compile(s) for s in _sea_signs]
+    _lake_pattern = re.compile('|'.join(_lake_signs))
+    _sea_pattern = re.compile('|'.join(_sea_signs))
 
     def __init__(self, _name,
                  length=0, dest_from_end=0, ten_km_trib_amount=0.0,
                  volume=None, index=None,
+                 names=None, main_name=None, volume_indexed_name=None,
+                 is_lake=None, is_sea=None, is_lost=None, is_nameless=None,
                  **kwargs):
 
-        self.names = list(filter(lambda x: len(x) > 0,
-                                 [n.strip() for n in self._split_pattern.split(_name)]))
-        self.multiname = True if len(self.names) > 1 else False
         self.length = length
         self.dest_from_end = dest_from_end
         self.ten_km_trib_amount = ten_km_trib_amount if not isnan(ten_km_trib_amount) else 0.0
         self.volume = volume
         self.index = index
 
+        if names is not None:
+            # Names were already split and classified by `classify`
+            self.names = names
+            self.main_name = main_name
+            self.volume_indexed_name = volume_indexed_name
+            self.nameless = is_nameless
+            self.lost = is_lost
+            self.is_lake = is_lake
+            self.is_sea = is_sea
+            if index and volume:
+                self.multiname = len(names) > 2
+                self.indexed_name = '{} №{}'.format(main_name, index)
+            else:
+                self.multiname = len(names) > 1
+                self.indexed_name = main_name
+            self._name()
+            return
+
+        self.names = list(filter(lambda x: len(x) > 0,
+                                 [n.strip() for n in self._split_pattern.split(_name)]))
+        self.multiname = True if len(self.names) > 1 else False
+
         self.main_name = self.names[0] if self.multiname else _name
         if index and volume:
             self.indexed_name = '{} №{}'.format(self.main_name, index)
@@ -71,28 +107,41 @@ class WaterObject(object):
         else:
             self.indexed_name = self.volume_indexed_name = self.main_name
 
-    @property
-    def name(self):
-        if self.nameless:
-            return self.indexed_name
-        else:
-            return self.names[0]
-
-    @property
-    def nameless(self):
-        return any(map(self._nameless_pattern.search, self.names))
-
-    @property
-    def lost(self):
-        return any(p.search(n) for p in self._lost_patterns for n in self.names)
-
-    @property
-    def is_lake(self):
-        return any(l.search(n) for l in self._lake_patterns for n in self.names)
+        self._classify()
 
-    @property
-    def is_sea(self):
-        return any(s.search(n) for s in self._sea_patterns for n in self.names)
+    def _classify(self):
+        """
+        Names never change, so all the regular expressions are evaluated once
+        """
+        self.nameless = self._matches(self._nameless_pattern)
+        self.lost = self._matches(self._lost_pattern)
+        self.is_lake = self._matches(self._lake_pattern)
+        self.is_sea = self._matches(self._sea_pattern)
+        self._name()
+
+    def _name(self):
+        self.name = self.indexed_name if self.nameless else self.names[0]
+        self._rehash()
+
+    def _rehash(self):
+        self._hash = hash(self.main_name if self.is_lake else self.name)
+
+    def __getstate__(self):
+        # String hashes differ between processes
+        return {k: getattr(self, k) for k in self.__slots__ if k != '_hash'}
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+        self._rehash()
+
+    def _matches(self, pattern):
+        for evaluated, name in enumerate(self.names, 1):
+            if pattern.search(name):
+                active().count("regex_evaluations", evaluated)
+                return True
+        active().count("regex_evaluations", len(self.names))
+        return False
 
     def __str__(self):
         if self.nameless:
@@ -115,21 +164,78 @@ class WaterObject(object):
                 "Cannot compare WaterObject instance to {}".format(type(other)))
 
     def __hash__(self):
-        if self.is_lake:
-            return self.main_name.__hash__()
-        else:
-            return self.name.__hash__()
+        return self._hash
 
 
-class RiverStack(DirectedGraph):
+def classify(names, volumes=None, indexes=None):
+    """
+    Vectorised counterpart of WaterObject name handling: splits and classifies
+    the whole Series of names at once. Returns DataFrame with the fields
+    that WaterObject accepts as precomputed ones.
+    """
+    raw = pandas.Series(names.values, dtype=object)
+    parts = raw.str.split(WaterObject._split_pattern.pattern).explode().str.strip()
+    parts = parts[parts.str.len() > 0]
+    grouped = parts.groupby(level=0)
+    multiname = grouped.size().reindex(raw.index, fill_value=0) > 1
+    main_name = raw.where(~multiname, grouped.first().reindex(raw.index))
+
+    if volumes is not None and indexes is not None:
+        volumes = pandas.Series(volumes).reset_index(drop=True).astype(str)
+        indexes = pandas.Series(indexes).reset_index(drop=True).astype(str)
+        indexed = (volumes.str.len() > 0) & (indexes.str.len() > 0)
+        indexed_name = main_name + ' №' + indexes
+        volume_indexed_name = (main_name + ' ' + volumes + '_' + indexes).where(
+            indexed, main_name)
+        # Indexed name always follows the others
+        parts = pandas.concat([parts, indexed_name[indexed]]).sort_index(kind='mergesort')
+    else:
+        volume_indexed_name = main_name
+
+    def _flag(pattern):
+        active().count("regex_evaluations", len(parts))
+        with warnings.catch_warnings():
+            # Groups of the patterns are never extracted here
+            warnings.filterwarnings("ignore", "This pattern has match groups", UserWarning)
+            matched = parts.str.contains(pattern, na=False)
+        matched = matched.groupby(level=0).any()
+        return matched.reindex(raw.index, fill_value=False)
+
+    classified = pandas.DataFrame({
+        "names": parts.groupby(level=0).agg(list).reindex(raw.index),
+        "main_name": main_name,
+        "volume_indexed_name": volume_indexed_name,
+        "is_lake": _flag(WaterObject._lake_pattern),
+        "is_sea": _flag(WaterObject._sea_pattern),
+        "is_lost": _flag(WaterObject._lost_pattern),
+        "is_nameless": _flag(WaterObject._nameless_pattern),
+    })
+    classified.index = names.index
+    return classified
 
-    # FIXME: wanna have the only instance for NameSuggestion
-    # for all the RiverStack instances. Is it correct?
-    ns = NameSuggestion()
 
-    def __init__(self, root):
-        super().__init__(root)
+class RiverStack(DirectedGraph):
+
+    def __init__(self, root, names=None, position=0, fuzzy=None, backend="networkx",
+                 row=0, validate=False, bassins=None):
+        super().__init__(root, backend=backend, validate=validate, bassins=bassins)
         self.rivers = []
+        # Multiset of the names of the rivers kept in the stack
+        self.river_names = Counter()
+        # Name index shared by all the stacks of the same RiverSystems:
+        # {name: {stack: [depth, ...]}}
+        self.names = names if names is not None else {}
+        self.position = position
+        # Number of the row the river system was first met at
+        self.row = row
+        # Optional TrigramIndex over the same names
+        self.fuzzy = fuzzy
+
+    def __getstate__(self):
+        # Shared indexes stay with the owner of the stack
+        state = self.__dict__.copy()
+        state.update(names=None, fuzzy=None, bassins=None)
+        return state
 
     def __str__(self):
         if self.rivers:
@@ -146,13 +252,6 @@ class RiverStack(DirectedGraph):
     def __len__(self):
         return len(self.rivers)
 
-    def refresh_namelist(f):
-        def wrapper(self, *args):
-            res = f(self, *args)
-            self.river_names = list(chain(*(r.names for r in self.rivers)))
-            return res
-        return wrapper
-
     @property
     def last_river(self):
         return self.rivers[-1]
@@ -161,36 +260,59 @@ class RiverStack(DirectedGraph):
     def next_order_river(self):
         return self.rivers[-2]
 
-    @refresh_namelist
     def push(self, river):
         """
         When the river is pushed to the appropriate stack,
         it's stored in the tributary list of the next order river
         """
         self.rivers.append(river)
+        depth = len(self.rivers) - 1
+        self.river_names.update(river.names)
+        for name in river.names:
+            if self.fuzzy is not None and name not in self.names:
+                self.fuzzy.add(name)
+            self.names.setdefault(name, {}).setdefault(self, []).append(depth)
         self.add_node()
 
-    @refresh_namelist
     def pop(self):
-        self.rivers.pop()
+        self._truncate(len(self.rivers) - 1)
+
+    def pop_until(self, dest):
+        """
+        Unwinds the stack down to the topmost river called like dest
+        """
+        names = [dest] if isinstance(dest, str) else dest.names
+        depth = max(self.names[name][self][-1] for name in names
+                    if name in self.river_names)
+        self._truncate(depth + 1)
+
+    def _truncate(self, size):
+        for river in reversed(self.rivers[size:]):
+            for name in river.names:
+                self.river_names[name] -= 1
+                if not self.river_names[name]:
+                    del self.river_names[name]
+                stacks = self.names[name]
+                depths = stacks[self]
+                depths.pop()
+                if not depths:
+                    del stacks[self]
+                    if not stacks:
+                        del self.names[name]
+                        if self.fuzzy is not None:
+                            self.fuzzy.discard(name)
+        del self.rivers[size:]
 
     def __contains__(self, river):
-        # No river_names is typical for nameless rivers or
-        # rivers related to internal drainage areas
-        if not hasattr(self, 'river_names'):
-            return False
-        else:
-            if set(river.names).intersection(self.river_names):
-                return True
-            else:
-                return False
+        return any(name in self.river_names for name in river.names)
 
-    def find_similar(self, dest):
-        for name in self.ns.suggest(dest):
-            exists = name in self.river_names
-            if exists:
-                logging.debug("\tSuggesting '{}' instead of '{}'".format(name, dest))
-                return name
+
+def _order_and_draw(rs, detail):
+    with recording(Stats()) as stats:
+        rs.order()
+        paths = rs.draw(**detail)
+    state = {k: getattr(rs, k) for k in ("DG", "results", "dot", "tour", "amounts", "confluences")}
+    return state, paths, stats
 
 
 class RiverSystems(object):
@@ -200,13 +322,27 @@ class RiverSystems(object):
     initial data. This class is trying to keep track of every of them.
     """
 
-    _root_signs = []
-    _root_signs.extend(_lost)
-    _root_signs.extend(_lake_signs)
+    # The only instance is shared by all the river systems
+    ns = NameSuggestion()
 
-    def __init__(self, fixtures=None):
+    def __init__(self, fixtures=None, fuzzy=0, batch=False, backend="networkx",
+                 leading=True, validate=False, stats=None):
         self.roots = OrderedDict()
-        self.root_signs = [re.compile(p) for p in self._root_signs]
+        self.backend = backend
+        self.validate = validate
+        self.active_root = None
+        self.row_count = 0
+        # Whether the data starts from the very beginning: then the first
+        # destination met is a root whatever it looks like
+        self.leading = leading
+        # Every river currently kept in stacks is indexed by all of its names
+        # in order to find destinations without scanning the stacks
+        self.names = {}
+
+        # When no suggestion matches, the nearest name not farther than
+        # `fuzzy` edits may be taken instead
+        self.fuzzy_distance = fuzzy
+        self.fuzzy = TrigramIndex() if fuzzy else None
 
         # Some large lakes and reservoirs are described like a distinct bassins
         # while in fact they are part of large river system
@@ -218,6 +354,21 @@ class RiverSystems(object):
         self.fake_roots = fixtures.get("fake_roots", {}) if \
             fixtures else {}
 
+        # In batch mode nobody is asked about unknown destinations: such rows
+        # are deferred till the end of the scan. All rivers ever pushed are
+        # remembered then: {name: [(row, stack, river), ...]}
+        self.batch = batch
+        self.deferred = []
+        self.unresolved = []
+        self.known = {}
+
+        # Read-only copy of the river networks, see `export`
+        self.network = None
+        # {node name: stack of the river system it was first described in}
+        self.bassins = {}
+        # Timings and counters of the run, see `stats.Stats`
+        self.stats = stats if stats is not None else Stats()
+
     def __len__(self):
         return len(self.roots)
 
@@ -225,6 +376,8 @@ class RiverSystems(object):
         return pprint.pformat(self.roots, indent=4)
 
     def add_river(self, river, dest):
+        self.row_count += 1
+        self.stats.count("rows")
         root_kind = self._estimate_root(dest)
         if not root_kind:
             self._add_tributary(river, dest)
@@ -239,11 +392,11 @@ class RiverSystems(object):
         # so we need to check the fixtures first
         fake_root_conditions = (
             root.name in self.fake_roots,
-            not any(root in stack for stack in self.roots.values())
+            not self._river_exists(root)
         )
         real_root_conditions = (
-            len(self) == 0,
-            any(p.match(name) for name in root.names for p in self.root_signs),
+            len(self) == 0 and self.leading,
+            root.lost or root.is_lake,
             root in self.hanging_roots,
         )
         if all(fake_root_conditions):
@@ -257,7 +410,7 @@ class RiverSystems(object):
     def _add_root(self, river, dest, forced=False):
         if not dest.lost or forced:
             self._create_root(dest)
-            self.roots[dest].push(river)
+            self._push(self.roots[dest], river)
         else:
             self._create_root(river)
 
@@ -283,9 +436,47 @@ root? [y/n]""".format(river, dest)
     def _create_root(self, root):
         # All fences are passed: that's really new river system
         logging.debug("Creating new root for '{}'...".format(root))
-        self.roots[root] = RiverStack(root)
+        position, row = len(self.roots), self.row_count
+        if root in self.roots:
+            # Stack to be replaced should not be found anymore
+            replaced = self.roots[root]
+            position, row = replaced.position, replaced.row
+            replaced._truncate(0)
+            self._forget(replaced)
+        self.roots[root] = RiverStack(root, names=self.names, position=position,
+                                      fuzzy=self.fuzzy, backend=self.backend,
+                                      row=row, validate=self.validate,
+                                      bassins=self.bassins)
         self.active_root = root
-        self.roots[root].push(root)
+        self._push(self.roots[root], root)
+
+    def _forget(self, stack):
+        """
+        Nodes of the river system to be replaced are looked up in the other
+        ones: they might have been described there as well
+        """
+        dropped = [n for n, found in self.bassins.items() if found is stack]
+        for n in dropped:
+            del self.bassins[n]
+        for other in self.roots.values():
+            if other is stack:
+                continue
+            for n in dropped:
+                if n not in self.bassins and n in other.DG and len(other.DG.node[n]) != 0:
+                    self.bassins[n] = other
+
+    def check_bassins(self):
+        # Every node must be found in a river system that is still there
+        live = set(map(id, self.roots.values()))
+        for n, stack in self.bassins.items():
+            assert id(stack) in live, "Node: {}; river system {} was replaced".format(
+                n, stack.root)
+
+    def _push(self, stack, river):
+        stack.push(river)
+        if self.batch:
+            for name in river.names:
+                self.known.setdefault(name, []).append((self.row_count, stack, river))
 
     def _add_fake_root(self, root):
         logging.debug("Fake root detected: {}".format(root))
@@ -301,60 +492,240 @@ root? [y/n]""".format(river, dest)
         target_stack = None
 
         # Good situation
-        for root, stack in self.roots.items():
-            if dest in stack:
-                target_stack = stack
-                self.active_root = root
+        target_stack = self._locate(dest.names)
+        if target_stack:
+            self.active_root = target_stack.root
 
         # Emergency situation - river was not found in any stack
         if not target_stack:
-            for root, stack in self.roots.items():
-                similar = stack.find_similar(dest)
-                if similar:
-                    dest = similar
-                    target_stack = stack
-                    self.active_root = root
-                    break
+            similar = self.find_similar(dest)
+            if similar:
+                dest, target_stack = similar
+                self.active_root = target_stack.root
 
         if not target_stack:
+            if self.batch:
+                logging.debug("Deferring '{}': '{}' is unknown yet".format(river, dest))
+                self.deferred.append((self.row_count, river, dest))
             # maybe someone want to add roots interactively rather than with
-            if not self._add_root_manually(river, dest):
+            elif not self._add_root_manually(river, dest):
                 raise Exception("Destination river '{}' wasn't found anywhere".format(dest))
         else:
-            while dest != target_stack[-1]:
-                target_stack.pop()
-            target_stack.push(river)
+            size = len(target_stack)
+            target_stack.pop_until(dest)
+            self.stats.count("stack_pops", size - len(target_stack))
+            self._push(target_stack, river)
 
     @property
     def active_system(self):
-        return self.active_root, self.roots[self.active_root]
+        return self.active_root, self.roots.get(self.active_root)
+
+    def resolve_deferred(self):
+        """
+        Extra pass over the deferred rows, when all the names are known.
+        Rivers are attached to the graph of the river system their
+        destination was found in. Returns the rows that are still unresolved.
+        """
+        deferred, self.deferred = self.deferred, []
+        for row, river, dest in deferred:
+            found = self._recall(dest, row)
+            if found:
+                stack, dest_river = found
+                logging.debug("Resolved deferred '{}' -> '{}'".format(river, dest_river))
+                stack.add_river_node(river, dest_river)
+                for name in river.names:
+                    self.known.setdefault(name, []).append((row, stack, river))
+            else:
+                self.unresolved.append((row, river, dest))
+        return self.unresolved
+
+    def _recall(self, dest, row):
+        # Among the namesakes the closest preceding river is preferred
+        for name in chain(dest.names, self.ns.suggest(dest)):
+            entries = self.known.get(name)
+            if entries:
+                entries.sort(key=lambda e: e[0])
+                i = bisect([e[0] for e in entries], row)
+                _, stack, river = entries[i - 1] if i > 0 else entries[0]
+                return stack, river
+
+    @classmethod
+    def merge(cls, parts, **kwargs):
+        """
+        Unites river systems built from independent parts of the data.
+        Every part comes with the numbers its rows have in the whole data,
+        so that river systems follow in the order they were discovered.
+        """
+        merged = cls(**kwargs)
+        stacks = []
+        for rss, rows in parts:
+            merged.row_count += rss.row_count
+            merged.stats.merge(rss.stats)
+            for name, found in rss.names.items():
+                merged.names.setdefault(name, {}).update(found)
+            for i, (root, stack) in enumerate(rss.roots.items()):
+                stacks.append((rows[stack.row - 1] + 1, i, root, stack))
+            merged.unresolved.extend((rows[row - 1] + 1, river, dest)
+                                     for row, river, dest in rss.unresolved)
+
+        for position, (row, _, root, stack) in enumerate(sorted(stacks, key=lambda s: s[:2])):
+            stack.names = merged.names
+            stack.bassins = merged.bassins
+            stack.position = position
+            stack.row = row
+            merged.roots[root] = stack
+            for n in stack.DG.nodes_iter():
+                if len(stack.DG.node[n]) != 0:
+                    merged.bassins.setdefault(n, stack)
+        merged.unresolved.sort(key=lambda u: u[0])
+        return merged
+
+    def report_unresolved(self, session_name):
+        fname = session_name + ".unresolved.json"
+        report = [{"volume": river.volume, "index": river.index,
+                   "river": str(river), "dest": str(dest)}
+                  for _, river, dest in self.unresolved]
+        print("{} rows are unresolved. Reporting to {}...".format(len(report), fname))
+        with open(fname, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+
+    def _locate(self, names):
+        """
+        Returns the latest created stack containing any of the names
+        """
+        located = None
+        for name in names:
+            for stack in self.names.get(name, ()):
+                if not located or stack.position > located.position:
+                    located = stack
+        return located
+
+    def find_similar(self, dest):
+        """
+        Probes all the suggested names against the name index at once.
+        Returns the name and the earliest created stack containing it, or None
+        """
+        found = None
+        for name in self.ns.suggest(dest):
+            for stack in self.names.get(name, ()):
+                if not found or stack.position < found[1].position:
+                    found = name, stack
+        if found:
+            self.stats.count("suggestion_fallbacks")
+            logging.debug("\tSuggesting '{}' instead of '{}'".format(found[0], dest))
+        elif self.fuzzy is not None:
+            found = self._find_nearest(dest)
+        return found
+
+    def _find_nearest(self, dest):
+        for name in dest.names:
+            nearest = self.fuzzy.nearest(name, self.fuzzy_distance)
+            if nearest:
+                stack = min(self.names[nearest], key=lambda s: s.position)
+                self.stats.count("fuzzy_fallbacks")
+                logging.debug("\tFuzzy matching '{}' instead of '{}'".format(nearest, dest))
+                return nearest, stack
 
     def _river_exists(self, river):
-        return any(river in stack for stack in self.roots.values())
+        return any(name in self.names for name in river.names)
+
+    def export(self, dirname):
+        """
+        Exports river networks to memory-mapped arrays and keeps them open
+        for read-only queries
+        """
+        self.network = None
+        export(self, dirname)
+        self.network = ReadOnlyNetwork(dirname)
 
     def get_river_system_by_element(self, water_object_name):
-        return next((root, stack) for root, stack in self.roots.items() if
-                    len(stack.DG.node[water_object_name]) != 0)
-
-    def render(self, water_object_name=None):
-        if water_object_name:
-            root, rs = self.get_river_system_by_element(water_object_name)
-            if rs:
-                rs.order()
-                rs.draw_from_node(water_object_name)
+        """
+        Returns root and stack of the river system the node belongs to,
+        or (None, None) if there's no such node
+        """
+        stack = self.bassins.get(water_object_name)
+        if stack is None:
+            return None, None
+        return stack.root, stack
+
+    def get_river_systems_by_elements(self, water_object_names):
+        """
+        Batch counterpart of `get_river_system_by_element`: returns
+        {node name: (root, stack)}, unknown names are mapped to (None, None)
+        """
+        return OrderedDict((name, self.get_river_system_by_element(name))
+                           for name in water_object_names)
+
+    def render(self, water_object_name=None, workers=None, min_order=None, max_depth=None,
+               tile_order=None):
+        """
+        Draws the bassin of the node or every river system. Tributaries of
+        lower order than `min_order` or deeper than `max_depth` are collapsed;
+        with `tile_order` bassins are cut into tiles. Returns the paths of
+        the .dot files written.
+        """
+        self.check_bassins()
+        detail = dict(min_order=min_order, max_depth=max_depth, tile_order=tile_order)
+        paths = []
+        # Ordering and rendering record to the stats of these river systems
+        with recording(self.stats):
+            if water_object_name:
+                root, rs = self.get_river_system_by_element(water_object_name)
+                if rs is not None:
+                    rs.order()
+                    paths.extend(rs.draw_from_node(water_object_name, **detail))
+                else:
+                    print("Node {} hasn't been found anywhere".format(water_object_name))
+            elif workers:
+                # The largest bassins go first not to be waited for in the end
+                systems = sorted(self.roots.items(), key=lambda s: len(s[1].DG), reverse=True)
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    futures = [executor.submit(_order_and_draw, rs, detail) for _, rs in systems]
+                    for (root, rs), future in zip(systems, futures):
+                        print("Rendering {} bassin".format(root))
+                        state, written, stats = future.result()
+                        rs.__dict__.update(state)
+                        self.stats.merge(stats)
+                        paths.extend(written)
             else:
-                print("Node {} hasn't been found anywhere".format(water_object_name))
-        else:
-            for root, rs in self.roots.items():
-                print("Rendering {} bassin".format(root))
-                rs.order()
-                rs.draw()
-
-    def dump(self, session_name):
-        print("Concatenating results...")
-        #df = pandas.DataFrame(list(chain(rs.results for rs in self.roots.values())))
-
-        df = pandas.concat((pandas.DataFrame(rs.results) for rs in self.roots.values() if len(rs.results) > 0))
-        fname = session_name + ".result.csv"
-        print("Resulting DataFrame is {}. Dumping to {}...".format(df.shape, fname))
-        df.to_csv(fname, sep=";")
+                for root, rs in self.roots.items():
+                    print("Rendering {} bassin".format(root))
+                    rs.order()
+                    paths.extend(rs.draw(**detail))
+        return paths
+
+    def node_table(self):
+        """
+        DataFrame of all the nodes of river networks with their attributes
+        """
+        names = ("bassin", "node", "dest", "described", "name", "volume", "index", "length",
+                 "dest_from_end", "ten_km_trib_amount", "order", "is_lake", "is_sea")
+        columns = OrderedDict((k, []) for k in names)
+        for rs in self.roots.values():
+            for n in rs.DG.nodes_iter():
+                attrs = rs.DG.node[n]
+                successors = rs.DG.successors(n)
+                columns["bassin"].append(rs.root.name)
+                columns["node"].append(n)
+                columns["dest"].append(successors[0] if successors else None)
+                columns["described"].append(len(attrs) != 0)
+                for k in ("name", "volume", "index"):
+                    columns[k].append(attrs.get(k))
+                for k in ("length", "dest_from_end", "ten_km_trib_amount", "order"):
+                    columns[k].append(attrs.get(k, float("nan")))
+                for k in ("is_lake", "is_sea"):
+                    columns[k].append(bool(attrs.get(k, False)))
+        return pandas.DataFrame(columns)
+
+    def dump(self, session_name, format="csv"):
+        """
+        Writes the confluence table and the node table in one of the
+        `output.writers` formats
+        """
+        with self.stats.phase("dump"):
+            print("Concatenating results...")
+            tables = OrderedDict([
+                ("result", Results.concat(rs.results for rs in self.roots.values())),
+                ("nodes", self.node_table()),
+            ])
+            writers[format](tables, session_name)
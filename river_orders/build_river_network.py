@@ -1,18 +1,24 @@
 #!/usr/bin/python3
 # -*- coding: utf8 -*-
 
+import os
 import sys
 import traceback
 import argparse
 import logging
-from itertools import chain
+from itertools import chain, count
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
 import numpy as np
 import yaml
 
-from river_orders.build import WaterObject, RiverSystems
+from river_orders.build import WaterObject, RiverSystems, classify
+from river_orders.graph import backends, layout
+from river_orders.output import writers, pyarrow
+from river_orders.stats import Stats, recording, active
+from river_orders import cache
 
 if __debug__:
     pd.set_option("display.width", 160)
@@ -20,31 +26,45 @@ if __debug__:
     _rs = None
 
 
-def prepare(df):
+def _ffill(column, state, name):
+    column = column.ffill()
+    if state is not None:
+        # Leading gaps are filled from the previous chunk
+        if name in state:
+            column = column.fillna(state[name])
+        if len(column) > 0:
+            state[name] = column.iloc[-1]
+    return column
+
+
+def prepare(df, state=None, verbose=True):
     """
-    Fixing most common bugs in the DataFrame with initial data
+    Fixing most common bugs in the DataFrame with initial data. When the data
+    is read by chunks, `state` dict carries the values filled downwards from
+    one chunk to the next one.
     """
     # 1. Splitting the id by two separate fields
     nan_values = np.delete(df.columns.values, 0)
 
     df.insert(0, "region", df[pd.isnull(df[nan_values]).all(1)]["id"])
-    df["region"] = df["region"].ffill()
+    df["region"] = _ffill(df["region"], state, "region")
 
     df.insert(1, "river_id", df[~pd.isnull(df[nan_values]).all(1)]["id"])
-    df = df[~pd.isnull(df["river_id"])]
+    df = df[~pd.isnull(df["river_id"])].copy()
     df.set_index(["volume", "river_id"], inplace=True, drop=True)
     del df["id"]
 
     # 2. Fill downwards "»" values
     def _fill(col):
         df.loc[[x in ("«", "»") for x in df[col]], col] = np.nan
-        df[col] = df[col].ffill()
+        df[col] = _ffill(df[col], state, col)
     for col in ("river_dest", "side"):
         _fill(col)
 
     # 3. Convert strings to numbers
     def _str_to_numbers(col):
-        print("Transforming '{}'...".format(col))
+        if verbose:
+            print("Transforming '{}'...".format(col))
         try:
             df.loc[df[col] == "—", col] = np.nan
             df.loc[df[col] == "-", col] = np.nan
@@ -54,38 +74,223 @@ def prepare(df):
     for col in ("ten_km_trib_amount", "length", "dest_from_end"):
         _str_to_numbers(col)
 
+    # 4. Split and classify the names once for the whole DataFrame
+    if verbose:
+        print("Classifying names...")
+    rivers = classify(df["river_full_name"],
+                      volumes=df.index.get_level_values("volume"),
+                      indexes=df.index.get_level_values("river_id"))
+    dests = classify(df["river_dest"])
+    for prefix, classified in (("river_", rivers), ("dest_", dests)):
+        for col in classified:
+            df[prefix + col] = classified[col].values
+
     return df
 
 
-def construct(df, **kwargs):
+# Identifiers must stay strings even if the data happen to be all-numeric
+_dtypes = {"id": str, "volume": str}
+
+
+def read_chunks(datafile, chunksize):
+    """
+    Reads and prepares initial data chunk by chunk, so that the whole corpus
+    never resides in memory
+    """
+    state = {}
+    reader = pd.read_csv(datafile, sep=";", chunksize=chunksize, dtype=_dtypes)
+    for n in count():
+        with active().phase("read_csv"):
+            chunk = next(reader, None)
+        if chunk is None:
+            return
+        print("Preparing chunk #{}...".format(n))
+        with active().phase("prepare"):
+            prepared = prepare(chunk, state=state, verbose=False)
+        yield prepared
+
+
+_classified = ("names", "main_name", "volume_indexed_name",
+               "is_lake", "is_sea", "is_lost", "is_nameless")
+_river_columns = ("river_full_name", "length", "dest_from_end", "ten_km_trib_amount") + \
+    tuple("river_" + f for f in _classified)
+_dest_columns = ("river_dest",) + tuple("dest_" + f for f in _classified)
+
+
+def stream(df):
+    """
+    Yields index, river and its destination for every row of the prepared
+    DataFrame. Only the columns WaterObject needs are taken, and they are
+    iterated as plain lists rather than as pandas rows.
+    """
+    volumes = df.index.get_level_values("volume").tolist()
+    river_ids = df.index.get_level_values("river_id").tolist()
+    rivers = zip(*(df[col].tolist() for col in _river_columns))
+    dests = zip(*(df[col].tolist() for col in _dest_columns))
+
+    for volume, river_id, r, d in zip(volumes, river_ids, rivers, dests):
+        river = WaterObject(r[0], r[1], r[2], r[3], volume, river_id, *r[4:])
+        dest = WaterObject(d[0], 0, 0, 0.0, None, None, *d[1:])
+        yield (volume, river_id), river, dest
+
+
+def construct(data, **kwargs):
+    """
+    Builds river systems from prepared DataFrame or from iterable of them
+    """
     rss = RiverSystems(**kwargs)
+    frames = [data] if isinstance(data, pd.DataFrame) else data
 
-    for index, r in df.iterrows():
-        volume = index[0]
-        assert(isinstance(volume, str)), "{}: wrong volume: {}".format(r, volume)
+    # Chunks read on the fly are timed within the construction
+    with recording(rss.stats), rss.stats.phase("construct"):
+        for index, river, dest in chain.from_iterable(map(stream, frames)):
+            volume = index[0]
+            assert(isinstance(volume, str)), "{}: wrong volume: {}".format(river, volume)
 
-        river = WaterObject(_name=r.river_full_name, volume=volume, index=index[1], **r)
-        dest = WaterObject(_name=r.river_dest)
-        try:
-            rss.add_river(river, dest)
-        except Exception:
-            print(traceback.format_exc())
-            print(rss)
-            sys.exit(1)
+            try:
+                rss.add_river(river, dest)
+            except Exception:
+                print(traceback.format_exc())
+                print(rss)
+                sys.exit(1)
+            else:
+                message = " ".join(str(m) for m in chain(index, rss.active_system))
+                logging.debug(message)
+
+        if rss.batch:
+            rss.resolve_deferred()
+
+    return rss
+
+
+def partition(df, fixtures=None):
+    """
+    Splits rows of the prepared DataFrame into groups that never refer to
+    each other: rows sharing a name that may be looked up as a destination
+    (directly, by a suggestion or via fake roots) fall into the same group.
+    Returns the list of groups as sorted arrays of row numbers.
+    """
+    rss = RiverSystems(fixtures=fixtures)
+    rows = [(river, dest) for _, river, dest in stream(df)]
+
+    known = set(chain.from_iterable(river.names for river, _ in rows))
+    # Names every row may look its destination up by
+    links = []
+    for _, dest in rows:
+        linked = set() if dest.lost else set(dest.names)
+        linked.update(n for n in rss.ns.suggest(dest) if n in known)
+        if dest.name in rss.fake_roots:
+            linked.update(WaterObject(rss.fake_roots[dest.name]["dest"]).names)
+        links.append(linked)
+    keys = set(chain.from_iterable(links))
+
+    parent = list(range(len(df)))
+    ids = {}
+
+    def _find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def _union(i, name):
+        j = ids.get(name)
+        if j is None:
+            ids[name] = i
         else:
-            message = " ".join(str(m) for m in chain(index, rss.active_system))
-            logging.debug(message)
+            parent[_find(i)] = _find(j)
+
+    for row, ((river, dest), linked) in enumerate(zip(rows, links)):
+        # Rivers flowing into lost ones become roots themselves
+        for name in (river.names if dest.lost else keys.intersection(river.names)):
+            _union(row, name)
+        for name in linked:
+            _union(row, name)
+
+    groups = {}
+    for row in range(len(df)):
+        groups.setdefault(_find(row), []).append(row)
+    return [np.array(g) for g in groups.values()]
 
+
+def _construct_part(df, kwargs):
+    rss = construct(df, **kwargs)
+    # Only needed to resolve the destinations of this very part
+    rss.known.clear()
+    rss.deferred = []
+    # Rebuilt when the parts are merged
+    rss.bassins.clear()
     return rss
 
 
+def construct_parallel(df, workers, fixtures=None, stats=None, **kwargs):
+    """
+    Builds river systems from independent parts of prepared DataFrame in
+    `workers` processes. Unknown destinations are never asked about: rows
+    are processed out of the order a user would expect.
+    """
+    groups = sorted(partition(df, fixtures), key=len, reverse=True)
+    print("{} independent groups of rows found, the largest one has {} rows".format(
+        len(groups), len(groups[0]) if groups else 0))
+
+    # The largest groups go first to the least loaded buckets
+    buckets = [[] for _ in range(workers)]
+    for group in groups:
+        min(buckets, key=lambda b: sum(map(len, b))).append(group)
+    buckets = [np.sort(np.concatenate(b)) for b in buckets if b]
+
+    kwargs.update(fixtures=fixtures, batch=True)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_construct_part, df.iloc[rows],
+                                   dict(kwargs, leading=rows[0] == 0))
+                   for rows in buckets]
+        parts = [(f.result(), rows) for f, rows in zip(futures, buckets)]
+
+    return RiverSystems.merge(parts, stats=stats, **kwargs)
+
+
 def parse_options():
     parser = argparse.ArgumentParser()
     parser.add_argument("datafile", help="CSV file with initial data",
                         type=str)
     parser.add_argument("-f", "--fixture", help="List of fixtures", type=str)
     parser.add_argument("-N", "--node", help="Name of node to draw separate network from", type=str)
+    parser.add_argument("-z", "--fuzzy", help="Max edit distance for fuzzy matching of "
+                        "unknown destinations (0 disables it)", type=int, default=0)
+    parser.add_argument("-b", "--batch", help="Never ask for unknown destinations: "
+                        "resolve them after the scan and report the rest",
+                        action="store_true")
+    parser.add_argument("-c", "--chunksize", help="Read initial data by chunks of "
+                        "that many lines", type=int)
+    parser.add_argument("-g", "--graph", help="Storage for river networks",
+                        choices=sorted(backends), default="networkx")
+    parser.add_argument("-o", "--min-order", help="Collapse tributaries of lower "
+                        "order into aggregate nodes when rendering", type=float)
+    parser.add_argument("-d", "--max-depth", help="Collapse tributaries deeper than "
+                        "that into aggregate nodes when rendering", type=int)
+    parser.add_argument("-t", "--tile-order", help="Cut bassins into separate .dot "
+                        "files at tributaries of that order and higher", type=float)
+    parser.add_argument("-l", "--layout", help="Lay out the .dot files written "
+                        "with that many concurrent Graphviz processes", type=int)
+    parser.add_argument("-O", "--output", help="Format of the results (parquet "
+                        "and arrow require optional pyarrow package)",
+                        choices=sorted(writers), default="csv")
+    parser.add_argument("-C", "--cache", help="Directory to keep constructed river "
+                        "systems in: they are reused while the data, the fixtures "
+                        "and the code stay the same", type=str)
+    parser.add_argument("-E", "--export", help="Directory to export river networks "
+                        "to as memory-mapped arrays", type=str)
+    parser.add_argument("-V", "--validate", help="Check every river network edge "
+                        "at the moment it's added", action="store_true")
+    parser.add_argument("-w", "--workers", help="Build independent river systems "
+                        "in that many processes (implies --batch)", type=int)
+    parser.add_argument("-r", "--render-workers", help="Order and render river "
+                        "systems in that many processes", type=int)
     args = parser.parse_args()
+    if args.workers and (args.chunksize or args.fuzzy):
+        parser.error("--workers can't be combined with --chunksize or --fuzzy")
+    if args.output != "csv" and pyarrow is None:
+        parser.error("--output {} requires pyarrow to be installed".format(args.output))
     return args
 
 
@@ -99,9 +304,6 @@ def main():
     fname = prefix + "-" + tstamp + ".log"
     logging.basicConfig(filename=fname, level=logging.DEBUG)
 
-    # main data
-    df = prepare(pd.read_csv(options.datafile, sep=";"))
-
     # fixtures list
     if options.fixture:
         with open(options.fixture) as f:
@@ -109,8 +311,42 @@ def main():
     else:
         fixtures = None
 
-    # Build multiple river systems from initial data
-    rss = construct(df, fixtures=fixtures)
+    # Options the river systems depend on
+    construction = dict(fuzzy=options.fuzzy, batch=bool(options.batch or options.workers),
+                        backend=options.graph)
+    cached = None
+    if options.cache:
+        key = cache.cache_key(options.datafile, options.fixture, **construction)
+        cached = os.path.join(options.cache, key + ".npz")
+
+    if cached and os.path.exists(cached):
+        df = None
+        rss = cache.load(cached, fixtures=fixtures, validate=options.validate, **construction)
+    else:
+        # main data, the stats of the run start with reading it
+        stats = Stats()
+        if options.chunksize:
+            df = read_chunks(options.datafile, options.chunksize)
+        else:
+            with stats.phase("read_csv"):
+                df = pd.read_csv(options.datafile, sep=";", dtype=_dtypes)
+            with recording(stats), stats.phase("prepare"):
+                df = prepare(df)
+
+        # Build multiple river systems from initial data
+        if options.workers:
+            rss = construct_parallel(df, options.workers, fixtures=fixtures, stats=stats,
+                                     backend=options.graph, validate=options.validate)
+        else:
+            rss = construct(df, fixtures=fixtures, validate=options.validate, stats=stats,
+                            **construction)
+
+        if cached:
+            os.makedirs(options.cache, exist_ok=True)
+            cache.save(rss, cached)
+
+    if rss.batch:
+        rss.report_unresolved(session_name=prefix)
 
     if __debug__:
         global _df, _rss
@@ -119,12 +355,23 @@ def main():
         # print(rss)
 
     # Draw selected part of river_network. If nothing selected, draw everything
+    detail = dict(min_order=options.min_order, max_depth=options.max_depth,
+                  tile_order=options.tile_order)
     if options.node:
-        rss.render(options.node)
+        paths = rss.render(options.node, **detail)
     else:
-        rss.render()
+        paths = rss.render(workers=options.render_workers, **detail)
+
+    if options.layout:
+        print("Laying out {} pictures...".format(len(paths)))
+        layout(paths, workers=options.layout)
+
+    if options.export:
+        # River orders are known after rendering only
+        rss.export(options.export)
 
-    rss.dump(session_name=prefix)
+    rss.dump(session_name=prefix, format=options.output)
+    rss.stats.report(prefix + ".stats.json")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,150 @@
+#! -*- coding: utf8 -*-
+import os
+import json
+import hashlib
+
+import numpy as np
+
+from .build import WaterObject, RiverStack, RiverSystems
+
+
+# Node attributes kept in the cache, by their types
+_float_attrs = ("length", "dest_from_end", "ten_km_trib_amount")
+_bool_attrs = ("is_lake", "is_sea")
+_str_attrs = ("name", "volume", "index")
+
+
+def cache_key(*files, **options):
+    """
+    Hash of the input files, the options of the construction and the code
+    of the package: the cache becomes stale whenever any of them changes
+    """
+    digest = hashlib.sha1()
+    package = os.path.dirname(os.path.abspath(__file__))
+    sources = sorted(os.path.join(package, f) for f in os.listdir(package) if f.endswith(".py"))
+    for fname in list(files) + sources:
+        if fname is None:
+            continue
+        with open(fname, "rb") as f:
+            digest.update(f.read())
+    digest.update(json.dumps(options, sort_keys=True).encode("utf8"))
+    return digest.hexdigest()
+
+
+def _dumps(*water_objects):
+    return json.dumps([wo.__getstate__() for wo in water_objects], ensure_ascii=False)
+
+
+def _loads(s):
+    water_objects = []
+    for state in json.loads(s):
+        wo = WaterObject.__new__(WaterObject)
+        wo.__setstate__(state)
+        water_objects.append(wo)
+    return water_objects
+
+
+def _strings(values):
+    """
+    Strings with None values replaced by empty strings, and the mask of them
+    """
+    return (np.array(["" if v is None else str(v) for v in values], dtype=str),
+            np.array([v is None for v in values], dtype=np.bool_))
+
+
+def save(rss, fname):
+    """
+    Stores constructed river systems in NumPy .npz archive: every river
+    system is a range of rows in the nodes table, edges refer to the rows
+    """
+    roots, positions, rows, offsets = [], [], [], [0]
+    nodes, edges = [], []
+    attrs = {k: [] for k in _float_attrs + _bool_attrs + _str_attrs}
+    described = []
+
+    for root, stack in rss.roots.items():
+        # Replaced river system keeps the key it was first met with
+        roots.append(_dumps(root, stack.root))
+        positions.append(stack.position)
+        rows.append(stack.row)
+
+        DG = stack.DG
+        ids = {n: offsets[-1] + i for i, n in enumerate(DG.nodes())}
+        for n in DG.nodes():
+            node = DG.node[n]
+            nodes.append(n)
+            described.append(len(node) != 0)
+            for k in attrs:
+                attrs[k].append(node.get(k))
+            # Edges follow the order of tributaries, so that bassins are
+            # rendered the same way after loading
+            edges.extend((ids[trib], ids[n]) for trib in DG.predecessors(n))
+        offsets.append(len(nodes))
+
+    arrays = {
+        "roots": np.array(roots, dtype=str),
+        "positions": np.array(positions, dtype=np.int32),
+        "rows": np.array(rows, dtype=np.int64),
+        "offsets": np.array(offsets, dtype=np.int64),
+        "nodes": np.array(nodes, dtype=str),
+        "described": np.array(described, dtype=np.bool_),
+        "edges": np.array(edges, dtype=np.int32).reshape(-1, 2),
+        "unresolved": np.array([_dumps(river, dest) for _, river, dest in rss.unresolved],
+                               dtype=str),
+        "unresolved_rows": np.array([row for row, _, _ in rss.unresolved], dtype=np.int64),
+        "row_count": np.array(rss.row_count),
+    }
+    for k in _float_attrs:
+        arrays[k] = np.array([np.nan if v is None else v for v in attrs[k]], dtype=np.float64)
+    for k in _bool_attrs:
+        arrays[k] = np.array([bool(v) for v in attrs[k]], dtype=np.bool_)
+    for k in _str_attrs:
+        arrays[k], arrays[k + "_none"] = _strings(attrs[k])
+
+    print("Saving river systems to {}...".format(fname))
+    np.savez_compressed(fname, **arrays)
+
+
+def load(fname, **kwargs):
+    """
+    Restores river systems stored by `save`. They are ready to be rendered
+    and dumped but not to be extended: stacks of rivers are not kept.
+    """
+    print("Loading river systems from {}...".format(fname))
+    with np.load(fname, allow_pickle=False) as archive:
+        arrays = dict(archive.items())
+
+    rss = RiverSystems(**kwargs)
+    rss.row_count = int(arrays["row_count"])
+    rss.unresolved = [(row, *_loads(s)) for row, s in
+                      zip(arrays["unresolved_rows"].tolist(), arrays["unresolved"])]
+
+    nodes = arrays["nodes"].tolist()
+    columns = {k: arrays[k].tolist() for k in _float_attrs + _bool_attrs}
+    for k in _str_attrs:
+        columns[k] = [None if none else v
+                      for v, none in zip(arrays[k].tolist(), arrays[k + "_none"].tolist())]
+    described = arrays["described"].tolist()
+    edges = arrays["edges"].tolist()
+    offsets = arrays["offsets"].tolist()
+
+    # Edges of every river system are stored contiguously
+    edge_at = 0
+    for i, s in enumerate(arrays["roots"]):
+        key, root = _loads(s)
+        stack = RiverStack(root, names=rss.names, position=int(arrays["positions"][i]),
+                           backend=rss.backend, row=int(arrays["rows"][i]),
+                           validate=rss.validate, bassins=rss.bassins)
+        start, end = offsets[i], offsets[i + 1]
+        for j in range(start, end):
+            if described[j]:
+                stack.DG.add_node(nodes[j], **{k: columns[k][j] for k in columns})
+                rss.bassins.setdefault(nodes[j], stack)
+            else:
+                stack.DG.add_node(nodes[j])
+        while edge_at < len(edges) and edges[edge_at][1] < end:
+            u, v = edges[edge_at]
+            stack.DG.add_edge(nodes[u], nodes[v])
+            edge_at += 1
+        rss.roots[key] = stack
+    return rss
@@ -0,0 +1,245 @@
+#! -*- coding: utf8 -*-
+import numpy as np
+
+
+class StringTable(object):
+
+    """
+    Stores every distinct value once, columns keep integer codes only
+    """
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def decode(self, code):
+        return self.values[code]
+
+
+class NodeAttrs(object):
+
+    """
+    Dict-like view over the columns of the only node
+    """
+    __slots__ = ('graph', 'i')
+
+    def __init__(self, graph, i):
+        self.graph = graph
+        self.i = i
+
+    def keys(self):
+        if not self.graph.described[self.i]:
+            return []
+        keys = list(ForestGraph.attributes)
+        if np.isnan(self.graph.columns["order"][self.i]):
+            keys.remove("order")
+        return keys
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        value = self.graph.columns[key][self.i]
+        if key in ForestGraph.encoded:
+            return self.graph.strings.decode(value)
+        return value.item()
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __setitem__(self, key, value):
+        if key not in ForestGraph.attributes:
+            raise KeyError(key)
+        if key in ForestGraph.encoded:
+            value = self.graph.strings.encode(value)
+        self.graph.columns[key][self.i] = value
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class NodeView(object):
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __getitem__(self, name):
+        return NodeAttrs(self.graph, self.graph.ids[name])
+
+    def __contains__(self, name):
+        return name in self.graph.ids
+
+    def __len__(self):
+        return len(self.graph.ids)
+
+    def __iter__(self):
+        return iter(self.graph)
+
+
+class ForestGraph(object):
+
+    """
+    Compact storage for the river network, that is a forest: every river
+    flows into the only destination. Parent pointers and node attributes
+    are kept in NumPy arrays, tributaries are kept as linked lists of
+    siblings. Only the part of networkx.DiGraph interface used by
+    DirectedGraph is provided.
+    """
+
+    # name -> dtype
+    attributes = {
+        "name": np.int32,
+        "length": np.float64,
+        "dest_from_end": np.float64,
+        "ten_km_trib_amount": np.float64,
+        "order": np.float64,
+        "is_lake": np.bool_,
+        "is_sea": np.bool_,
+        "volume": np.int32,
+        "index": np.int32,
+    }
+    # These ones are stored as codes in the string table
+    encoded = ("name", "volume", "index")
+
+    def __init__(self, capacity=16):
+        # Slots of removed nodes are kept as None
+        self.names = []
+        self.removed = 0
+        self.ids = {}
+        self.strings = StringTable()
+        self.node = NodeView(self)
+
+        self.parent = np.full(capacity, -1, dtype=np.int32)
+        self.first_child = np.full(capacity, -1, dtype=np.int32)
+        self.last_child = np.full(capacity, -1, dtype=np.int32)
+        self.next_sibling = np.full(capacity, -1, dtype=np.int32)
+        self.described = np.zeros(capacity, dtype=np.bool_)
+        self.columns = {k: np.zeros(capacity, dtype=t) for k, t in self.attributes.items()}
+        self.columns["order"][:] = np.nan
+
+        # Edges that don't fit into the forest, i.e. second destinations.
+        # They are kept to be reported by DirectedGraph.check_graph
+        self.extra_successors = {}
+
+    def __len__(self):
+        return len(self.names) - self.removed
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def __iter__(self):
+        if not self.removed:
+            return iter(self.names)
+        return (n for n in self.names if n is not None)
+
+    def _grow(self):
+        capacity = len(self.parent)
+
+        def _extended(column, fill):
+            tail = np.full(capacity, fill, dtype=column.dtype)
+            return np.concatenate((column, tail))
+
+        for attr in ("parent", "first_child", "last_child", "next_sibling"):
+            setattr(self, attr, _extended(getattr(self, attr), -1))
+        self.described = _extended(self.described, False)
+        for k, column in self.columns.items():
+            self.columns[k] = _extended(column, np.nan if k == "order" else 0)
+
+    def _id(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+            if i == len(self.parent):
+                self._grow()
+        return i
+
+    def add_node(self, n, **attrs):
+        i = self._id(n)
+        # Like in networkx, node without attributes is known by name only
+        if attrs:
+            self.described[i] = True
+        view = NodeAttrs(self, i)
+        for k, v in attrs.items():
+            view[k] = v
+
+    def add_edge(self, u, v):
+        i, j = self._id(u), self._id(v)
+        if self.parent[i] == j:
+            return
+        if self.parent[i] != -1:
+            self.extra_successors.setdefault(u, []).append(v)
+            return
+        self.parent[i] = j
+        if self.first_child[j] == -1:
+            self.first_child[j] = i
+        else:
+            self.next_sibling[self.last_child[j]] = i
+        self.last_child[j] = i
+
+    def remove_node(self, n):
+        """
+        Removes the node with its edges: tributaries lose their destination.
+        The slot of the node is never reused.
+        """
+        i = self.ids.pop(n)
+        for child in list(self.children(i)):
+            self.parent[child] = self.next_sibling[child] = -1
+        self.first_child[i] = self.last_child[i] = -1
+
+        j = self.parent[i]
+        if j != -1:
+            previous, c = -1, self.first_child[j]
+            while c != i:
+                previous, c = c, self.next_sibling[c]
+            if previous == -1:
+                self.first_child[j] = self.next_sibling[i]
+            else:
+                self.next_sibling[previous] = self.next_sibling[i]
+            if self.last_child[j] == i:
+                self.last_child[j] = previous
+
+        self.parent[i] = self.next_sibling[i] = -1
+        self.described[i] = False
+        self.columns["order"][i] = np.nan
+        self.extra_successors.pop(n, None)
+        self.names[i] = None
+        self.removed += 1
+
+    def children(self, i):
+        child = self.first_child[i]
+        while child != -1:
+            yield child
+            child = self.next_sibling[child]
+
+    def predecessors(self, name):
+        return [self.names[c] for c in self.children(self.ids[name])]
+
+    def successors(self, name):
+        parent = self.parent[self.ids[name]]
+        successors = [self.names[parent]] if parent != -1 else []
+        return successors + self.extra_successors.get(name, [])
+
+    def nodes(self):
+        return list(self)
+
+    def nodes_iter(self):
+        return iter(self)
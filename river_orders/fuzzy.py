@@ -0,0 +1,108 @@
+#! -*- coding: utf8 -*-
+def levenshtein(a, b, limit=None):
+    """
+    Edit distance between two strings. When limit is given, computation stops
+    as soon as the distance is known to exceed it (limit + 1 is returned then)
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (ca != cb)))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class TrigramIndex(object):
+
+    """
+    Index of names by their character trigrams and lengths. Helps to find
+    the nearest (in terms of edit distance) name without comparing it to
+    every name known.
+    """
+
+    def __init__(self):
+        self.grams = {}
+        # {(trigram, name length): set of names}
+        self.postings = {}
+        # {name length: set of names}, for names too short to be filtered
+        self.lengths = {}
+
+    def __len__(self):
+        return len(self.grams)
+
+    def __contains__(self, name):
+        return name in self.grams
+
+    @staticmethod
+    def trigrams(name):
+        padded = "  {} ".format(name.lower())
+        return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+    def add(self, name):
+        if name in self.grams:
+            return
+        grams = self.trigrams(name)
+        self.grams[name] = grams
+        for g in grams:
+            self.postings.setdefault((g, len(name)), set()).add(name)
+        self.lengths.setdefault(len(name), set()).add(name)
+
+    def discard(self, name):
+        grams = self.grams.pop(name, ())
+        for g in grams:
+            key = (g, len(name))
+            names = self.postings[key]
+            names.discard(name)
+            if not names:
+                del self.postings[key]
+        if grams:
+            names = self.lengths[len(name)]
+            names.discard(name)
+            if not names:
+                del self.lengths[len(name)]
+
+    def nearest(self, name, max_distance):
+        """
+        Returns the indexed name closest to the given one if it's not farther
+        than max_distance edits, or None
+        """
+        grams = self.trigrams(name)
+        lengths = range(max(len(name) - max_distance, 0), len(name) + max_distance + 1)
+
+        def _postings(g):
+            return [self.postings[(g, l)] for l in lengths if (g, l) in self.postings]
+
+        candidates = set()
+        if len(grams) <= 3 * max_distance:
+            # Short names may lose all of their trigrams, every name of
+            # a close enough length is a candidate then
+            for l in lengths:
+                candidates.update(self.lengths.get(l, ()))
+        else:
+            # Single edit spoils up to three trigrams, so any close enough name
+            # shares at least one of the 3 * max_distance + 1 rarest trigrams
+            rarest = sorted(grams, key=lambda g: sum(map(len, _postings(g))))
+            for g in rarest[:3 * max_distance + 1]:
+                candidates.update(*_postings(g))
+
+        # Most similar candidates go first to narrow the search quickly
+        ranked = sorted((-len(grams & self.grams[c]), c) for c in candidates)
+        best, best_distance = None, max_distance + 1
+        for common, candidate in ranked:
+            # Lost trigrams give the lower bound of the distance
+            if -(-(len(grams) + common) // 3) >= best_distance:
+                break
+            distance = levenshtein(name, candidate, limit=best_distance - 1)
+            if distance < best_distance:
+                best, best_distance = candidate, distance
+        return best
@@ -1,14 +1,20 @@
 import os
 import sys
+import json
 import traceback
-from itertools import tee, chain
-from collections import namedtuple
+from collections import namedtuple, Counter
+from concurrent.futures import ThreadPoolExecutor
 
-from pandas import Series
-from numpy import isnan, log2
+from numpy import log2, isnan
+import numpy as np
 import networkx
 import graphviz
 
+from .forest import ForestGraph
+from .results import Results
+from .tour import EulerTour
+from .stats import active
+
 
 def scheidegger(ten_km_trib_amount):
     if ten_km_trib_amount > 0.0:
@@ -22,93 +28,260 @@ class GraphvizNode(namedtuple("GraphvizNode",
 
     @staticmethod
     def from_digraph_node(DG, name):
-        gn = None
         try:
-            gn = GraphvizNode(name=name,
-                              ten_km_trib_amount=DG.node[name]["ten_km_trib_amount"],
-                              order=DG.node[name]["order"])
-        except Exception as e:
-            print("Error while handling node '{}'".format(name), e)
-            sys.exit(1)
-        else:
-            return gn
+            attrs = DG.node[name]
+            return GraphvizNode(name=name,
+                                ten_km_trib_amount=attrs["ten_km_trib_amount"],
+                                order=attrs["order"])
+        except KeyError as e:
+            raise Exception("Error while handling node '{}': {}".format(name, e))
+
+
+# Storages for river networks
+backends = {
+    "networkx": networkx.DiGraph,
+    "forest": ForestGraph,
+}
+
+
+def layout(paths, workers=None, format="svg"):
+    """
+    Runs Graphviz layouts of the .dot files concurrently. Every layout is
+    a separate `dot` process, threads only wait for them.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda path: graphviz.render("dot", format, path), paths))
 
 
 class DirectedGraph(object):
 
     """
     Mixin class that provides a Networkx storage for river
-    networks.
+    networks (or compact ForestGraph storage if requested).
 
     Since pygraphviz doesn't work with Python3, we'll need to
     draw graph manually with graphviz.
     """
 
-    def __init__(self, root):
+    def __init__(self, root, backend="networkx", validate=False, bassins=None):
         self.root = root
         self.dot = graphviz.Digraph(format='svg')
-        self.DG = networkx.DiGraph()
-        self.results = []
+        self.DG = backends[backend]()
+        self.results = Results()
+        # Whether every edge is checked at the moment it's added
+        self.validate = validate
+        # Optional {node name: graph} shared by several graphs
+        self.bassins = bassins
+        # Index of the bassin built by `order`
+        self.tour = None
+        # Own amounts of small tributaries kept by `order` for incremental
+        # updates: {node name: amount}
+        self.amounts = None
+        # Rows of results made by every rendered river: {node name: range}
+        self.confluences = {}
 
     def add_node(self):
+        if len(self) > 1:
+            self.add_river_node(self.last_river, self.next_order_river)
+        else:
+            self.add_river_node(self.last_river)
+
+    def add_river_node(self, river, dest=None):
         # TODO: the fact that we cannot use river as a node
         # is very annoying. Need to modify hashing
-        if self.last_river.is_lake or self.last_river.is_sea:
-            last_node_name = self.last_river.name
+        if river.is_lake or river.is_sea:
+            node_name = river.name
         else:
-            last_node_name = self.last_river.volume_indexed_name
-
-        self.DG.add_node(last_node_name,
-                         name=self.last_river.name,
-                         length=self.last_river.length,
-                         dest_from_end=self.last_river.dest_from_end,
-                         ten_km_trib_amount=self.last_river.ten_km_trib_amount,
-                         is_lake=self.last_river.is_lake,
-                         is_sea=self.last_river.is_sea,
-                         volume=self.last_river.volume,
-                         index=self.last_river.index)
-
-        if len(self) > 1:
-            if self.last_river.is_lake or self.last_river.is_sea:
-                next_order_node_name = self.next_order_river.name
+            node_name = river.volume_indexed_name
+
+        self.DG.add_node(node_name,
+                         name=river.name,
+                         length=river.length,
+                         dest_from_end=river.dest_from_end,
+                         ten_km_trib_amount=river.ten_km_trib_amount,
+                         is_lake=river.is_lake,
+                         is_sea=river.is_sea,
+                         volume=river.volume,
+                         index=river.index)
+        if self.bassins is not None:
+            # The node stays with the graph it was described in first
+            self.bassins.setdefault(node_name, self)
+
+        if dest is not None:
+            if river.is_lake or river.is_sea:
+                dest_node_name = dest.name
             else:
-                next_order_node_name = self.next_order_river.volume_indexed_name
-            self.DG.add_edge(last_node_name,
-                             next_order_node_name)
-
-    def _set_node_order(self, river_node_name, ten_km_trib_amount):
-        self.DG.node[river_node_name]['ten_km_trib_amount'] = ten_km_trib_amount
-        self.DG.node[river_node_name]['order'] = scheidegger(ten_km_trib_amount)
+                dest_node_name = dest.volume_indexed_name
+            if self.validate:
+                self._validate_edge(node_name, dest_node_name)
+            self.DG.add_edge(node_name, dest_node_name)
+
+    def _provenance(self, node_name):
+        attrs = self.DG.node[node_name] if node_name in self.DG else {}
+        return "'{}' (volume {}, index {})".format(
+            node_name, attrs.get("volume"), attrs.get("index"))
+
+    def _validate_edge(self, node_name, dest_node_name):
+        """
+        Checks that the edge keeps the graph a forest. The graph is supposed
+        to be valid before, so the walk to the root always ends.
+        """
+        successors = self.DG.successors(node_name) if node_name in self.DG else []
+        if successors and dest_node_name not in successors:
+            raise Exception("{} already flows into {}, not into {}".format(
+                self._provenance(node_name), successors, self._provenance(dest_node_name)))
+
+        n = dest_node_name
+        while n is not None:
+            if n == node_name:
+                raise Exception("{} flowing into {} makes a cycle".format(
+                    self._provenance(node_name), self._provenance(dest_node_name)))
+            successors = self.DG.successors(n) if n in self.DG else []
+            n = successors[0] if successors else None
+
+    def _bassin(self, river_node_name):
+        """
+        Breadth-first traversal of the river bassin without recursion.
+        Returns the nodes, positions of their destinations (-1 for the
+        starting node) and their depths; depths never decrease.
+        """
+        nodes, parents, depths = [river_node_name], [-1], [0]
+        seen = {river_node_name}
+        i = 0
+        while i < len(nodes):
+            for trib in self.DG.predecessors(nodes[i]):
+                # Cycles are reported by check_graph
+                if trib not in seen:
+                    seen.add(trib)
+                    nodes.append(trib)
+                    parents.append(i)
+                    depths.append(depths[i] + 1)
+            i += 1
+        return nodes, np.array(parents), np.array(depths)
 
     def _sum_small_tribs(self, river_node_name):
-        node_attrs = self.DG.node[river_node_name]
-        tributaries = self.DG.predecessors(river_node_name)
-
-        if len(tributaries) == 0:
-            if isnan(node_attrs["ten_km_trib_amount"]):
-                ten_km_trib_amount = 1.0
-            else:
-                ten_km_trib_amount = node_attrs["ten_km_trib_amount"]
-
-            self._set_node_order(river_node_name, ten_km_trib_amount)
-            return ten_km_trib_amount
-
-        else:
-            ten_km_trib_recur_sum = sum(map(self._sum_small_tribs, tributaries))
-            ten_km_trib_recur_sum += node_attrs['ten_km_trib_amount']
-            self._set_node_order(river_node_name, ten_km_trib_recur_sum)
-
-            return ten_km_trib_recur_sum
+        nodes, parents, depths = self._bassin(river_node_name)
+        attrs = [self.DG.node[n] for n in nodes]
+
+        # Attributes hold the sums once ordered, own amounts are kept aside
+        amounts = self.amounts if self.amounts is not None else {}
+        total = np.array([amounts.get(n, a["ten_km_trib_amount"]) for n, a in zip(nodes, attrs)],
+                         dtype=float)
+        leaves = np.bincount(parents[1:], minlength=len(nodes)) == 0
+        self.amounts = dict(zip(nodes, total.tolist()))
+        total[leaves & np.isnan(total)] = 1.0
+        own = total.copy()
+
+        # Every level of tributaries is added to the next order rivers at once
+        bounds = np.searchsorted(depths, np.arange(depths[-1] + 2))
+        for level in range(depths[-1], 0, -1):
+            lo, hi = bounds[level], bounds[level + 1]
+            np.add.at(total, parents[lo:hi], total[lo:hi])
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            orders = np.where(total > 0.0, np.log2(total) + 1.0, 1.0)
+
+        for a, ten_km_trib_amount, order in zip(attrs, total.tolist(), orders.tolist()):
+            a['ten_km_trib_amount'] = ten_km_trib_amount
+            a['order'] = order
+
+        self.tour = EulerTour(nodes, parents, depths, ten_km_trib_amount=own, order=orders,
+                              length=[a["length"] for a in attrs])
+        return total[0]
 
     def order(self):
         if __debug__:
             print("\tEstimating river orders...")
-        if self.root.is_lake:
-            self._sum_small_tribs(self.root.name)
-        else:
-            self._sum_small_tribs(self.root.volume_indexed_name)
-
-    def gen_confluenced(self, trib_prev, trib_next, dest):
+        with active().phase("order"):
+            if self.root.is_lake:
+                self._sum_small_tribs(self.root.name)
+            else:
+                self._sum_small_tribs(self.root.volume_indexed_name)
+
+    def _own_amount(self, node_name):
+        amount = self.amounts[node_name]
+        # Sources with unknown amount are counted as a small tributary
+        if isnan(amount) and len(self.DG.predecessors(node_name)) == 0:
+            return 1.0
+        return amount
+
+    def _reorder_downstream(self, node_name):
+        """
+        Sums of small tributaries and orders are updated from the node down
+        to the root only, rendered confluences of these rivers are remade
+        """
+        path = []
+        while node_name is not None:
+            path.append(node_name)
+            successors = self.DG.successors(node_name)
+            node_name = successors[0] if successors else None
+
+        for n in path:
+            # The same sequence of additions as in _sum_small_tribs
+            total = self._own_amount(n)
+            for trib in self.DG.predecessors(n):
+                total += self.DG.node[trib]["ten_km_trib_amount"]
+            self.DG.node[n]["ten_km_trib_amount"] = total
+            self.DG.node[n]["order"] = scheidegger(total)
+
+        for n in path:
+            self._remake_confluences(n)
+        # Ranges of subtrees are not valid anymore
+        self.tour = None
+
+    def _remake_confluences(self, river_node_name):
+        rows = self.confluences.pop(river_node_name, None)
+        if rows is None:
+            return
+        self.results.discard(rows)
+        tributaries = sorted(self.DG.predecessors(river_node_name),
+                             key=lambda name: self.DG.node[name]['dest_from_end'])
+        self.gen_confluenced(iter(tributaries), iter(tributaries), river_node_name)
+
+    def insert_river(self, river, dest):
+        """
+        Adds the river to the ordered network: only the rivers downstream
+        are reordered
+        """
+        if self.amounts is None:
+            raise Exception("River network must be ordered first")
+        # Named like in add_river_node
+        dest_node_name = dest.name if river.is_lake or river.is_sea else dest.volume_indexed_name
+        if dest_node_name not in self.amounts:
+            # Checked before anything is changed not to spoil the network
+            raise Exception("Destination '{}' of '{}' isn't an ordered node of {} bassin".format(
+                dest_node_name, river, self.root))
+        self.add_river_node(river, dest)
+        node_name = river.name if river.is_lake or river.is_sea else river.volume_indexed_name
+        self.amounts[node_name] = self.DG.node[node_name]["ten_km_trib_amount"]
+        self._reorder_downstream(node_name)
+
+    def remove_river(self, node_name):
+        """
+        Removes the river with all of its tributaries from the ordered
+        network: only the rivers downstream are reordered
+        """
+        if self.amounts is None:
+            raise Exception("River network must be ordered first")
+        successors = self.DG.successors(node_name)
+        for n in self._bassin(node_name)[0]:
+            rows = self.confluences.pop(n, None)
+            if rows is not None:
+                self.results.discard(rows)
+            self.amounts.pop(n, None)
+            if self.bassins is not None and self.bassins.get(n) is self:
+                del self.bassins[n]
+            self.DG.remove_node(n)
+        if successors:
+            self._reorder_downstream(successors[0])
+
+    def gen_confluenced(self, trib_prev, trib_next, dest, record=True):
+        if record:
+            # Rows of the bassin rendered before are replaced
+            rows = self.confluences.pop(dest, None)
+            if rows is not None:
+                self.results.discard(rows)
+        start = self.results.size
         next(trib_next, None)
         pair_list = reversed(list(zip(trib_prev, trib_next)))
         confluenced = []
@@ -140,116 +313,133 @@ class DirectedGraph(object):
             #         ten_km_trib_amount, order)
             #     print(msg)
 
-            result = Series({
-                "bassin": self.root.name,
-                "src": income_attrs["name"],
-                "src_volume": income_attrs["volume"],
-                "src_index": income_attrs["index"],
-                "src_10km_tribs": income_attrs["ten_km_trib_amount"],
-                "src_order": income_attrs["order"],
-                "dst": dest_attrs["name"],
-                "dst_volume": dest_attrs["volume"],
-                "dst_index": dest_attrs["index"],
-                "dst_10km_tribs": ten_km_trib_amount,
-                "dst_order": order,
-            })
-
             confluenced.append(GraphvizNode(name, ten_km_trib_amount, order))
+            if not record:
+                continue
 
             # Now need to store results
-            self.results.append(result)
-
+            self.results.append(
+                self.root.name,
+                income_attrs["name"],
+                income_attrs["volume"],
+                income_attrs["index"],
+                income_attrs["ten_km_trib_amount"],
+                income_attrs["order"],
+                dest_attrs["name"],
+                dest_attrs["volume"],
+                dest_attrs["index"],
+                ten_km_trib_amount,
+                order,
+            )
+
+        if record:
+            self.confluences[dest] = range(start, self.results.size)
         return confluenced
 
-    def river_bassin_elements(self, river_node_name, tributaries):
-        trib, trib_prev, trib_next = tee(tributaries, 3)
-
+    def river_bassin_elements(self, river_node_name, tributaries, record=True):
         # Make list of `confluence nodes`
-        confluenced = list(self.gen_confluenced(trib_prev, trib_next, river_node_name))
+        confluenced = self.gen_confluenced(iter(tributaries), iter(tributaries), river_node_name,
+                                           record=record)
         confluenced.reverse()
 
         # Create common nodes
-        mainline_node_names = chain(
-            [GraphvizNode.from_digraph_node(self.DG, river_node_name)],
-            confluenced)
-        sideline_node_names = (GraphvizNode.from_digraph_node(self.DG, t) for t in trib)
-        mnn0, mnn1, mnn2 = tee(mainline_node_names, 3)
-        snn0, snn1 = tee(sideline_node_names)
-        next(mnn0, None)
-
-        mnn1_prev, mnn1_next = tee(mnn1)
-        next(mnn1_next, None)
-        mainline_edges = zip(mnn1_next, mnn1_prev)
-
-        next(mnn2, None)
-        sideline_edges = zip(snn1, mnn2)
+        mainline = [GraphvizNode.from_digraph_node(self.DG, river_node_name)] + confluenced
+        sideline = [GraphvizNode.from_digraph_node(self.DG, t) for t in tributaries]
 
         # Crete edges
         if len(confluenced) > 0:
-            edges = [mainline_edges,
-                     sideline_edges,
-                     [
-                         (
-                             GraphvizNode.from_digraph_node(self.DG, tributaries[-1]),
-                             confluenced[-1]
-                         )
-                     ]]
+            edges = list(zip(mainline[1:], mainline[:-1]))
+            edges.extend(zip(sideline, mainline[1:]))
+            edges.append((sideline[-1], confluenced[-1]))
         else:
-            edge_ends = (tributaries[0], river_node_name)
-            edges = [[map(lambda x: GraphvizNode.from_digraph_node(self.DG, x),
-                          edge_ends)]]
+            edges = [(sideline[0], mainline[0])]
 
-        edge_names = list(chain(*edges))
+        return mainline[1:], sideline, edges
 
-        return mnn0, snn0, edge_names
-
-    def lake_bassin_elements(self, lake_node_name, tributaries):
+    def lake_bassin_elements(self, lake_node_name, tributaries, record=True):
         lake_node = GraphvizNode.from_digraph_node(self.DG, lake_node_name)
-
-        sideline_node_names = (GraphvizNode.from_digraph_node(self.DG, t) for t in tributaries)
-        snn0, snn1 = tee(sideline_node_names)
-        edges = ((s, lake_node) for s in snn1)
-
-        return [], snn0, edges
-
-    def _render_bassin(self, river_node_name):
+        sideline = [GraphvizNode.from_digraph_node(self.DG, t) for t in tributaries]
+        edges = [(s, lake_node) for s in sideline]
+
+        return [], sideline, edges
+
+    def _render_river(self, river_node_name, depth=0, min_order=None, max_depth=None,
+                      drawn=True):
+        """
+        Draws the river with its tributaries. Tributaries of lower order than
+        `min_order` or deeper than `max_depth` are drawn as the only aggregate
+        node. Returns the tributaries, each one with the flag whether it's
+        drawn.
+        """
         # If this is a fist order river, nothing to draw
-        if len(self.DG.predecessors(river_node_name)) == 0:
-            return
+        tributaries = self.DG.predecessors(river_node_name)
+        if len(tributaries) == 0:
+            return []
 
         # Lake and river bassin rendering are differing
-        is_lake = self.DG.node[river_node_name]["is_lake"]
-        is_sea = self.DG.node[river_node_name]["is_sea"]
-        if is_sea:
+        attrs = self.DG.node[river_node_name]
+        is_lake, is_sea = attrs["is_lake"], attrs["is_sea"]
+        if is_sea and drawn:
             print("--------SEA NODE RENDERING {}--------".format(river_node_name))
 
         # Preparing list of tributaries
-        try:
-            if is_lake or is_sea:
-                tributaries = self.DG.predecessors(river_node_name)
-                elements = self.lake_bassin_elements
-            else:
-                tributaries = sorted(self.DG.predecessors(river_node_name),
+        if is_lake or is_sea:
+            elements = self.lake_bassin_elements
+        else:
+            try:
+                tributaries = sorted(tributaries,
                                      key=lambda name: self.DG.node[name]['dest_from_end'])
-                elements = self.river_bassin_elements
-        except TypeError:
-            print("\tError while sorting {} tributaries: ".format(river_node_name))
-            for tr in self.DG.predecessors(river_node_name):
-                print("\t\t", tr, self.DG.node[tr])
-            traceback.print_exc()
-            sys.exit(1)
+            except TypeError:
+                print("\tError while sorting {} tributaries: ".format(river_node_name))
+                for tr in tributaries:
+                    print("\t\t", tr, self.DG.node[tr])
+                raise
+            elements = self.river_bassin_elements
+
+        shown, hidden = tributaries, []
+        if not drawn or (max_depth is not None and depth >= max_depth):
+            shown, hidden = [], tributaries
+        elif min_order is not None:
+            shown = [t for t in tributaries if self.DG.node[t]["order"] >= min_order]
+            hidden = [t for t in tributaries if self.DG.node[t]["order"] < min_order]
+
+        # Results are made of all the tributaries whatever is drawn
+        if hidden:
+            elements(river_node_name, tributaries)
+        if not drawn:
+            return [(t, False) for t in tributaries]
 
         # Draw nodes and edges
-        mainline, sideline, edges = elements(river_node_name, tributaries)
-        for n in mainline:
-            self.draw_node(n, confluenced=True)
-        for s in sideline:
-            self.draw_node(s, confluenced=False)
-        for (t, d) in edges:
-            self.dot.edge(t.name, d.name)
-
-        for trib_name in tributaries:
-            self._render_bassin(trib_name)
+        if shown:
+            mainline, sideline, edges = elements(river_node_name, shown, record=not hidden)
+            for n in mainline:
+                self.draw_node(n, confluenced=True)
+            for s in sideline:
+                self.draw_node(s, confluenced=False)
+            for (t, d) in edges:
+                self.dot.edge(t.name, d.name)
+        if hidden:
+            self.draw_aggregate(river_node_name, hidden)
+        shown = set(shown)
+        return [(t, t in shown) for t in tributaries]
+
+    def _flush(self, f):
+        # Statements never pile up in the body of Digraph
+        f.writelines(self.dot.body)
+        del self.dot.body[:]
+
+    def _render_bassin(self, river_node_name, f, min_order=None, max_depth=None):
+        """
+        Depth-first rendering without recursion: DOT statements of every
+        river are written to the file as soon as they are made. Bassins of
+        hidden tributaries are passed through for the results only.
+        """
+        stack = [(river_node_name, 0, True)]
+        while stack:
+            node_name, depth, drawn = stack.pop()
+            tributaries = self._render_river(node_name, depth, min_order, max_depth, drawn)
+            self._flush(f)
+            stack.extend((t, depth + 1, d) for t, d in reversed(tributaries))
 
     def draw_node(self, node, confluenced=False):
         order = str(node.order)[:4]
@@ -263,53 +453,165 @@ class DirectedGraph(object):
             self.dot.node(node.name,
                           label.format(node.name, trib_amount, order))
 
+    def draw_aggregate(self, river_node_name, tributaries):
+        amount = sum(self.DG.node[t]["ten_km_trib_amount"] for t in tributaries)
+        name = river_node_name + "__tributaries"
+        label = '<{} tributaries<BR /><FONT POINT-SIZE="10"> sum: {} ord: {}</FONT>>'
+        self.dot.node(name, label.format(len(tributaries), int(amount),
+                                         str(scheidegger(amount))[:4]), style="dashed")
+        self.dot.edge(name, river_node_name)
+
     def check_graph(self):
         print("\tChecking river network graph...")
-        # Looping is serious error
-        cycles = list(networkx.simple_cycles(self.DG))
-        assert len(cycles) == 0, "Cycles: {}".format(cycles)
-
-        # Now we need to be sure, that every river flows to the only
-        # destination
+        # Every river must flow to the only destination
+        parents = {}
         for n in self.DG.nodes_iter():
-            succesors = self.DG.successors(n)
-            assert (len(succesors) <= 1), "Node: {}; succesors: {}".format(n, succesors)
-
-    def draw(self):
-        self.check_graph()
-        # Draw graph from the river of the highest order
-        print("\tRendering...")
-        self.dot.node(self.root.volume_indexed_name)
-        try:
-            if self.root.is_lake or self.root.is_sea:
-                self._render_bassin(self.root.name)
+            successors = self.DG.successors(n)
+            assert len(successors) <= 1, "Node: {}; successors: {}".format(
+                self._provenance(n), successors)
+            if successors:
+                parents[n] = successors[0]
+
+        # So cycles are found by coloring the walks along parent pointers:
+        # every node is visited once
+        color = {}
+        for start in parents:
+            n = start
+            while n in parents and n not in color:
+                color[n] = start
+                n = parents[n]
+            if color.get(n) == start:
+                cycle, m = [n], parents[n]
+                while m != n:
+                    cycle.append(m)
+                    m = parents[m]
+                assert False, "Cycle: {}".format(", ".join(map(self._provenance, cycle)))
+
+    def _render_tiles(self, river_node_name, dirname, tile_order, min_order=None, max_depth=None):
+        """
+        Renders the bassin to separate .dot files cut at the tributaries of
+        `tile_order` and higher. Such a tributary is drawn in the tile of its
+        destination as a stub referring to its own tile, and vice versa.
+        Rivers are visited in the same order as by _render_bassin. Returns
+        the list of tiles for the manifest.
+        """
+        frame = list(self.dot)
+        tiles, files, pending = [], {}, Counter()
+
+        def _tile(root, parent):
+            tiles.append({"file": "{:04d}.dot".format(len(tiles)), "root": root,
+                          "parent": parent, "rivers": 0})
+            pending[len(tiles) - 1] += 1
+            return len(tiles) - 1
+
+        def _open(tile):
+            f = files[tile] = open(os.path.join(dirname, tiles[tile]["file"]), "w",
+                                   encoding=self.dot.encoding)
+            f.writelines(frame[:-1])
+            parent = tiles[tile]["parent"]
+            if parent is None:
+                self.dot.node(tiles[tile]["root"])
             else:
-                self._render_bassin(self.root.volume_indexed_name)
-        except Exception:
-            # Graph cycles cause endless recursion
-            traceback.format_exc()
-            sys.exit(1)
+                self.dot.node(tiles[tile]["root"], URL=tiles[parent]["file"], style="bold")
+            self._flush(f)
+
+        stack = [(river_node_name, 0, True, _tile(river_node_name, None))]
+        try:
+            while stack:
+                node_name, depth, drawn, tile = stack.pop()
+                if tile not in files:
+                    _open(tile)
+                f = files[tile]
+                tributaries = self._render_river(node_name, depth, min_order, max_depth, drawn)
+                if drawn:
+                    tiles[tile]["rivers"] += 1
+
+                for t, d in reversed(tributaries):
+                    if d and self.DG.node[t]["order"] >= tile_order:
+                        # Stub referring to the tile of the tributary
+                        t_tile = _tile(t, tile)
+                        self.dot.node(t, URL=tiles[t_tile]["file"], style="bold")
+                    else:
+                        t_tile = tile
+                        pending[tile] += 1
+                    stack.append((t, depth + 1, d, t_tile))
+                self._flush(f)
+
+                pending[tile] -= 1
+                if pending[tile] == 0:
+                    f.write(frame[-1])
+                    f.close()
+                    del files[tile]
         finally:
-            # Save to file
-            fname = '{}'.format(self.root.name + ".dot")
+            for f in files.values():
+                f.write(frame[-1])
+                f.close()
+
+        for tile in tiles:
+            if tile["parent"] is not None:
+                tile["parent"] = tiles[tile["parent"]]["file"]
+        return tiles
+
+    def _draw(self, first_node_name, river_node_name, fname, min_order=None, max_depth=None,
+              tile_order=None):
+        """
+        Returns the paths of the .dot files written
+        """
+        with active().phase("check_graph"):
+            self.check_graph()
+
+        with active().phase("render"):
+            # Draw graph from the river of the highest order
+            print("\tRendering...")
             path = os.path.join(os.path.dirname(sys.argv[0]), "pictures", fname)
-            print("\tSaving to {}...".format(path))
-            self.dot.save(path)
 
-    def draw_from_node(self, node_name):
-        self.check_graph()
+            if tile_order is not None:
+                dirname = path[:-len(".dot")] + ".tiles"
+                print("\tSaving tiles to {}...".format(dirname))
+                os.makedirs(dirname, exist_ok=True)
+                tiles = self._render_tiles(river_node_name, dirname, tile_order,
+                                           min_order, max_depth)
+                with open(os.path.join(dirname, "manifest.json"), "w") as f:
+                    json.dump({"bassin": first_node_name, "tile_order": tile_order,
+                               "tiles": tiles}, f, ensure_ascii=False, indent=4)
+                return [os.path.join(dirname, tile["file"]) for tile in tiles]
 
-        # Draw graph from the river of the highest order
-        print("\tRendering...")
-        self.dot.node(node_name)
+            print("\tSaving to {}...".format(path))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Digraph without a body gives the head and the tail of the source
+            frame = list(self.dot)
+            with open(path, "w", encoding=self.dot.encoding) as f:
+                f.writelines(frame[:-1])
+                try:
+                    self.dot.node(first_node_name)
+                    self._flush(f)
+                    self._render_bassin(river_node_name, f, min_order, max_depth)
+                finally:
+                    f.write(frame[-1])
+            return [path]
+
+    def draw(self, min_order=None, max_depth=None, tile_order=None):
+        """
+        Draws the whole bassin. Tributaries of lower order than `min_order`
+        or deeper than `max_depth` are collapsed into aggregate nodes. With
+        `tile_order` the bassin is cut into tiles at tributaries of that
+        order and higher. Returns the paths of the .dot files written.
+        """
+        if self.root.is_lake or self.root.is_sea:
+            river_node_name = self.root.name
+        else:
+            river_node_name = self.root.volume_indexed_name
         try:
-            self._render_bassin(node_name)
+            return self._draw(self.root.volume_indexed_name, river_node_name,
+                              self.root.name + ".dot", min_order, max_depth, tile_order)
         except Exception:
-            # Graph cycles cause endless recursion
-            traceback.format_exc()
-        finally:
-            # Save to file
-            fname = '{}'.format(node_name + ".dot")
-            path = os.path.join(os.path.dirname(sys.argv[0]), "pictures", fname)
-            print("\tSaving to {}...".format(path))
-            self.dot.save(path)
+            traceback.print_exc()
+            sys.exit(1)
+
+    def draw_from_node(self, node_name, min_order=None, max_depth=None, tile_order=None):
+        try:
+            return self._draw(node_name, node_name, node_name + ".dot", min_order, max_depth,
+                              tile_order)
+        except Exception:
+            traceback.print_exc()
+            return []
@@ -1,7 +1,10 @@
 #! -*- coding: utf8 -*-
 import itertools
+import functools
 import re
 
+from .stats import active
+
 
 class NameSuggestion(object):
 
@@ -49,35 +52,44 @@ class NameSuggestion(object):
     _case_insensitive_replacements = (
     )
 
-    def __init__(self):
+    def __init__(self, cache_size=4096):
         self.substrings = list(
             map(re.compile, self._substrings))
         self.replacements = list(
             map(lambda x: (re.compile(x[0]), x[1]), self._replacements))
         self.dash_capitalise = list(
             map(re.compile, self._dash_capitalise))
+        # The same typos are met over and over again
+        self._suggest_names = functools.lru_cache(maxsize=cache_size)(self._suggest_names)
 
     def suggest(self, river):
         """
         provides the set of unique suggested names, according to the list of
         regular expressions
         """
-        subs = (m.groups()[0] for name in river.names
+        return self._suggest_names(tuple(river.names))
+
+    def _suggest_names(self, names):
+        # Only misses of the cache get here
+        active().count("regex_evaluations", len(names) * (
+            len(self.substrings) + len(self.replacements) + len(self.dash_capitalise)))
+        subs = (m.groups()[0] for name in names
                 for m in map(lambda x: x.match(name), self.substrings) if m)
-        repls = (r[0].sub(r[1], name) for name in river.names
+        repls = (r[0].sub(r[1], name) for name in names
                  for r in self.replacements)
         dcs = ("-".join(map(lambda x: x.title(), m.groups()))
                for m in (dc.match(name)
-                         for name in river.names
+                         for name in names
                          for dc in self.dash_capitalise
                          ) if m)
-        titles = (name.title() for name in river.names)
+        titles = (name.title() for name in names)
 
         def _double_replacement(truncated, morphed, name):
             return name.replace(truncated, morphed), name.replace(morphed, truncated)
         abbrs = itertools.chain(
-            *(_double_replacement(r[0], morphed, name) for name in river.names
+            *(_double_replacement(r[0], morphed, name) for name in names
               for r in self._abbreviations for morphed in r[1]))
 
         g = itertools.tee(itertools.chain(subs, repls, dcs, titles, abbrs))
-        return set(itertools.chain(g[0], map(lambda x: x.strip(), g[1])))
+        # Tuple keeps the order of the set and is safe to be cached
+        return tuple(set(itertools.chain(g[0], map(lambda x: x.strip(), g[1]))))
@@ -0,0 +1,169 @@
+#! -*- coding: utf8 -*-
+import os
+
+import numpy as np
+
+
+_float_attrs = ("length", "dest_from_end", "ten_km_trib_amount", "order")
+_bool_attrs = ("is_lake", "is_sea")
+_str_attrs = ("name", "volume", "index")
+
+
+def export(rss, dirname):
+    """
+    Writes river systems to the directory as plain .npy arrays: parent
+    pointers, children in CSR form, attribute columns and a string table
+    (UTF-8 bytes and offsets of every string in them). Node names are also
+    kept sorted, so nodes are found by binary search.
+    """
+    strings, codes = [], {}
+
+    def _encode(value):
+        if value is None:
+            return -1
+        # Indexes and volumes may come as numbers from the data
+        value = str(value)
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(strings)
+            strings.append(value)
+        return code
+
+    nodes, parents, basins, roots, described = [], [], [], [], []
+    child_offsets, children = [0], []
+    columns = {k: [] for k in _float_attrs + _bool_attrs + _str_attrs}
+
+    for basin, stack in enumerate(rss.roots.values()):
+        DG = stack.DG
+        names = DG.nodes()
+        ids = {n: len(nodes) + i for i, n in enumerate(names)}
+        root = stack.root.name if stack.root.is_lake else stack.root.volume_indexed_name
+        roots.append(ids.get(root, -1))
+        for n in names:
+            attrs = DG.node[n]
+            nodes.append(_encode(n))
+            basins.append(basin)
+            # Nodes without attributes are known by name only
+            described.append(len(attrs) != 0)
+            successors = DG.successors(n)
+            parents.append(ids[successors[0]] if successors else -1)
+            children.extend(ids[t] for t in DG.predecessors(n))
+            child_offsets.append(len(children))
+            for k in _float_attrs:
+                columns[k].append(attrs.get(k, np.nan))
+            for k in _bool_attrs:
+                columns[k].append(bool(attrs.get(k, False)))
+            for k in _str_attrs:
+                columns[k].append(_encode(attrs.get(k)))
+
+    encoded = [s.encode("utf8") for s in strings]
+    arrays = {
+        "node": np.array(nodes, dtype=np.int32),
+        "parent": np.array(parents, dtype=np.int32),
+        "basin": np.array(basins, dtype=np.int32),
+        "root": np.array(roots, dtype=np.int32),
+        "described": np.array(described, dtype=np.bool_),
+        "child_offsets": np.array(child_offsets, dtype=np.int64),
+        "children": np.array(children, dtype=np.int32),
+        "strings": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        "string_offsets": np.cumsum([0] + [len(s) for s in encoded], dtype=np.int64),
+    }
+    # Ties are broken by the bassin, so the first match is the earliest one
+    arrays["sorted"] = np.array(sorted(range(len(nodes)),
+                                       key=lambda i: (strings[nodes[i]], basins[i])),
+                                dtype=np.int32)
+    for k in _float_attrs:
+        arrays[k] = np.array(columns[k], dtype=np.float64)
+    for k in _bool_attrs:
+        arrays[k] = np.array(columns[k], dtype=np.bool_)
+    for k in _str_attrs:
+        arrays[k] = np.array(columns[k], dtype=np.int32)
+
+    print("Exporting river network to {}...".format(dirname))
+    os.makedirs(dirname, exist_ok=True)
+    for k, array in arrays.items():
+        # Files are replaced rather than overwritten: other processes may
+        # keep the previous ones mapped
+        fname = os.path.join(dirname, k + ".npy")
+        with open(fname + ".tmp", "wb") as f:
+            np.save(f, array)
+        os.replace(fname + ".tmp", fname)
+
+
+class ReadOnlyNetwork(object):
+
+    """
+    River network exported by `export`. Arrays are memory-mapped, so any
+    number of processes share the only copy in the page cache and nothing
+    is deserialised.
+    """
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.arrays = {f[:-4]: np.load(os.path.join(dirname, f), mmap_mode="r")
+                       for f in os.listdir(dirname) if f.endswith(".npy")}
+
+    def __len__(self):
+        return len(self.arrays["node"])
+
+    def __getitem__(self, column):
+        return self.arrays[column]
+
+    def string(self, code):
+        if code < 0:
+            return None
+        offsets = self.arrays["string_offsets"]
+        return bytes(self.arrays["strings"][offsets[code]:offsets[code + 1]]).decode("utf8")
+
+    def name(self, i):
+        return self.string(self.arrays["node"][i])
+
+    def find(self, name, described=True):
+        """
+        Returns the first node with the given name (in the earliest bassin),
+        or None. Nodes without attributes are skipped unless `described` is
+        False.
+        """
+        ranked = self.arrays["sorted"]
+        lo, hi = 0, len(ranked)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.name(ranked[mid]) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        for i in ranked[lo:]:
+            if self.name(i) != name:
+                break
+            if self.arrays["described"][i] or not described:
+                return int(i)
+        return None
+
+    def bassin(self, name):
+        """
+        Number of the river system holding the node, or None
+        """
+        i = self.find(name)
+        return None if i is None else int(self.arrays["basin"][i])
+
+    def tributaries(self, i):
+        offsets = self.arrays["child_offsets"]
+        return self.arrays["children"][offsets[i]:offsets[i + 1]]
+
+    def upstream(self, name):
+        """
+        Nodes of the bassin of the given node, the node itself goes first
+        """
+        i = self.find(name)
+        if i is None:
+            return []
+        nodes, at = [i], 0
+        while at < len(nodes):
+            nodes.extend(int(t) for t in self.tributaries(nodes[at]))
+            at += 1
+        return nodes
+
+    def attrs(self, i):
+        attrs = {k: self.arrays[k][i].item() for k in _float_attrs + _bool_attrs}
+        attrs.update((k, self.string(self.arrays[k][i])) for k in _str_attrs)
+        return attrs
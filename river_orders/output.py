@@ -0,0 +1,53 @@
+#! -*- coding: utf8 -*-
+try:
+    import pyarrow
+    import pyarrow.dataset
+except ImportError:
+    pyarrow = None
+
+
+# Strings repeated over and over again are dictionary-encoded
+_categorical = {
+    "result": ("bassin", "src", "dst"),
+    "nodes": ("bassin", "name", "volume"),
+}
+
+
+def write_csv(tables, session_name):
+    for kind, df in tables.items():
+        fname = "{}.{}.csv".format(session_name, kind)
+        print("Resulting DataFrame is {}. Dumping to {}...".format(df.shape, fname))
+        df.to_csv(fname, sep=";")
+
+
+def _write_dataset(tables, session_name, format, extension):
+    if pyarrow is None:
+        raise Exception("pyarrow is required to write {} output".format(format))
+    for kind, df in tables.items():
+        df = df.reset_index(drop=True)
+        for col in _categorical[kind]:
+            df[col] = df[col].astype("category")
+        table = pyarrow.Table.from_pandas(df, preserve_index=False)
+        dirname = "{}.{}.{}".format(session_name, kind, extension)
+        print("Resulting table is {}. Dumping to {} by bassins...".format(df.shape, dirname))
+        # Without threads rows keep their order within partitions
+        pyarrow.dataset.write_dataset(table, dirname, format=format,
+                                      partitioning=["bassin"], partitioning_flavor="hive",
+                                      existing_data_behavior="delete_matching",
+                                      use_threads=False)
+
+
+def write_parquet(tables, session_name):
+    _write_dataset(tables, session_name, "parquet", "parquet")
+
+
+def write_arrow(tables, session_name):
+    _write_dataset(tables, session_name, "ipc", "arrow")
+
+
+# Output formats of RiverSystems.dump
+writers = {
+    "csv": write_csv,
+    "parquet": write_parquet,
+    "arrow": write_arrow,
+}
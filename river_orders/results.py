@@ -0,0 +1,87 @@
+#! -*- coding: utf8 -*-
+from collections import OrderedDict
+
+import numpy as np
+import pandas
+
+
+class Results(object):
+
+    """
+    Columnar accumulator of the confluence table. Every column is a typed
+    array growing by doubling, so no per-row objects are kept.
+    """
+
+    columns = OrderedDict([
+        ("bassin", object),
+        ("src", object),
+        ("src_volume", object),
+        ("src_index", object),
+        ("src_10km_tribs", np.float64),
+        ("src_order", np.float64),
+        ("dst", object),
+        ("dst_volume", object),
+        ("dst_index", object),
+        ("dst_10km_tribs", np.float64),
+        ("dst_order", np.float64),
+    ])
+
+    def __init__(self, capacity=64):
+        self.size = 0
+        self.data = [np.empty(capacity, dtype=t) for t in self.columns.values()]
+        # Rows invalidated by `discard` are skipped when the table is built
+        self.dropped = np.zeros(capacity, dtype=np.bool_)
+        self.dropped_count = 0
+
+    def __len__(self):
+        return self.size - self.dropped_count
+
+    def _grow(self):
+        self.data = [np.concatenate((column, np.empty_like(column)))
+                     for column in self.data]
+        self.dropped = np.concatenate((self.dropped, np.zeros_like(self.dropped)))
+
+    def discard(self, rows):
+        """
+        Invalidates rows appended before, e.g. range of them
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        self.dropped_count += len(rows) - np.count_nonzero(self.dropped[rows])
+        self.dropped[rows] = True
+
+    def _live(self, column):
+        column = column[:self.size]
+        return column[~self.dropped[:self.size]] if self.dropped_count else column
+
+    def append(self, *row):
+        """
+        Values go in the order of `columns`
+        """
+        if self.size == len(self.data[0]):
+            self._grow()
+        for column, value in zip(self.data, row):
+            column[self.size] = value
+        self.size += 1
+
+    def column(self, name):
+        return self._live(self.data[list(self.columns).index(name)])
+
+    def to_frame(self):
+        return self.concat([self])
+
+    @classmethod
+    def concat(cls, results):
+        """
+        Builds the only DataFrame for several accumulators. Like pandas.concat
+        over separate DataFrames, index starts from zero for each of them.
+        """
+        results = [r for r in results if len(r) > 0]
+        if not results:
+            return pandas.DataFrame(OrderedDict(
+                (name, np.empty(0, dtype=t)) for name, t in cls.columns.items()))
+
+        data = OrderedDict(
+            (name, np.concatenate([r._live(r.data[i]) for r in results]))
+            for i, name in enumerate(cls.columns))
+        index = np.concatenate([np.arange(len(r)) for r in results])
+        return pandas.DataFrame(data, index=index)
@@ -0,0 +1,83 @@
+#! -*- coding: utf8 -*-
+import json
+import time
+from collections import OrderedDict, Counter
+from contextlib import contextmanager
+
+
+class Stats(object):
+
+    """
+    Wall and CPU time spent in the phases of a run and counters of events.
+    Phases may nest; time of phases run by several processes is summed.
+    """
+
+    def __init__(self):
+        # {phase: [wall, cpu, calls]}
+        self.phases = OrderedDict()
+        self.counters = Counter()
+
+    def clear(self):
+        self.phases.clear()
+        self.counters.clear()
+
+    @contextmanager
+    def phase(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            spent = self.phases.setdefault(name, [0.0, 0.0, 0])
+            spent[0] += time.perf_counter() - wall
+            spent[1] += time.process_time() - cpu
+            spent[2] += 1
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def merge(self, other):
+        """
+        Adds up phases and counters of another run, e.g. of a worker process
+        """
+        for name, (wall, cpu, calls) in other.phases.items():
+            spent = self.phases.setdefault(name, [0.0, 0.0, 0])
+            spent[0] += wall
+            spent[1] += cpu
+            spent[2] += calls
+        self.counters.update(other.counters)
+
+    def as_dict(self):
+        return OrderedDict([
+            ("phases", OrderedDict(
+                (name, OrderedDict([("wall", wall), ("cpu", cpu), ("calls", calls)]))
+                for name, (wall, cpu, calls) in self.phases.items())),
+            ("counters", OrderedDict(sorted(self.counters.items()))),
+        ])
+
+    def report(self, fname):
+        print("Reporting timings and counters to {}...".format(fname))
+        for name, (wall, cpu, calls) in self.phases.items():
+            print("\t{}: {:.2f}s wall, {:.2f}s CPU, {} calls".format(name, wall, cpu, calls))
+        with open(fname, "w") as f:
+            json.dump(self.as_dict(), f, ensure_ascii=False, indent=4)
+
+
+# Stats being recorded in this process, the first one is never reported
+_recording = [Stats()]
+
+
+@contextmanager
+def recording(stats):
+    """
+    Makes code deep down the call stack, which knows nothing of the run
+    it's part of, add its timings and counters to the given stats
+    """
+    _recording.append(stats)
+    try:
+        yield stats
+    finally:
+        _recording.pop()
+
+
+def active():
+    return _recording[-1]
@@ -0,0 +1,94 @@
+#! -*- coding: utf8 -*-
+import numpy as np
+
+
+class EulerTour(object):
+
+    """
+    Depth-first entry/exit index of a river bassin. Every subtree is
+    a contiguous range of the tour, so membership checks are comparisons,
+    and sums and maximums of node attributes over a subtree are taken
+    from prefix sums and sparse tables in constant time.
+    """
+
+    def __init__(self, nodes, parents, depths, **values):
+        """
+        Nodes go in breadth-first order with positions of their
+        destinations and their depths, as DirectedGraph._bassin returns.
+        Values are arrays of node attributes in the same order.
+        """
+        n = len(nodes)
+        bounds = np.searchsorted(depths, np.arange(depths[-1] + 2))
+
+        size = np.ones(n, dtype=np.int64)
+        for level in range(depths[-1], 0, -1):
+            lo, hi = bounds[level], bounds[level + 1]
+            np.add.at(size, parents[lo:hi], size[lo:hi])
+
+        # Tributaries of the same river are adjacent in breadth-first order,
+        # so each one follows the subtrees of its preceding siblings
+        before = np.cumsum(size) - size
+        first = np.ones(n, dtype=np.bool_)
+        first[2:] = parents[2:] != parents[1:-1]
+        starts = np.flatnonzero(first)
+        offset = before - before[starts[np.cumsum(first) - 1]]
+
+        self.entry = np.zeros(n, dtype=np.int64)
+        for level in range(1, depths[-1] + 1):
+            lo, hi = bounds[level], bounds[level + 1]
+            self.entry[lo:hi] = self.entry[parents[lo:hi]] + 1 + offset[lo:hi]
+        self.exit = self.entry + size
+
+        tour = np.empty(n, dtype=np.int64)
+        tour[self.entry] = np.arange(n)
+        self.nodes = [nodes[i] for i in tour.tolist()]
+        self.positions = {name: i for i, name in enumerate(nodes)}
+
+        self.prefix = {}
+        self.sparse = {}
+        for attr, v in values.items():
+            v = np.asarray(v, dtype=np.float64)[tour]
+            self.prefix[attr] = np.concatenate(([0.0], np.cumsum(np.nan_to_num(v))))
+            # table[k][i] is the maximum of v[i:i + 2 ** k]
+            table = [v]
+            while 2 ** len(table) <= n:
+                half = 2 ** (len(table) - 1)
+                table.append(np.fmax(table[-1][:-half], table[-1][half:]))
+            self.sparse[attr] = table
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def _range(self, name):
+        i = self.positions[name]
+        return self.entry[i], self.exit[i]
+
+    def upstream(self, name):
+        """
+        The node and all of its tributaries, direct or not
+        """
+        lo, hi = self._range(name)
+        return self.nodes[lo:hi]
+
+    def is_upstream(self, name, of):
+        """
+        Whether the node belongs to the bassin of the other one
+        """
+        lo, hi = self._range(of)
+        return lo <= self.entry[self.positions[name]] < hi
+
+    def total(self, name, attr):
+        """
+        Sum of the attribute over the bassin of the node (NaN counts as 0)
+        """
+        lo, hi = self._range(name)
+        return self.prefix[attr][hi] - self.prefix[attr][lo]
+
+    def maximum(self, name, attr):
+        lo, hi = self._range(name)
+        k = int(hi - lo).bit_length() - 1
+        table = self.sparse[attr][k]
+        return np.fmax(table[lo], table[hi - 2 ** k]).item()
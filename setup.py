@@ -31,4 +31,8 @@ published in USSR Surface water resources""",
         ('/usr/bin/', ['scripts/river-orders-prepare-data']),
     ],
     install_requires=reqs,
+    extras_require={
+        # Parquet and Arrow output
+        'arrow': ['pyarrow'],
+    },
 )